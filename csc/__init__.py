@@ -1,9 +1,16 @@
 from csc.utils import *
 
 import csc.data
+import csc.context
+import csc.index
+import csc.cache
+import csc.matcher
+import csc.bootstrap
 import csc.report
 import csc.evaluation
+import csc.sweep
 import csc.verification
+import csc.inference
 
 TRAIN = 'train'
 TEST = 'test'
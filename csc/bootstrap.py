@@ -0,0 +1,90 @@
+import pathlib
+
+import numpy as np
+
+SAMPLE_COUNTS_FILE = 'sample-counts.npz'
+
+
+def metrics(tp: np.ndarray, fp: np.ndarray, fn: np.ndarray) -> dict[str, np.ndarray]:
+    """Same formulas as `EvaluationResult.Metric.from_counts`, for arrays of totals"""
+    precision = tp / (tp + fp + 1e-8)
+    recall = tp / (tp + fn + 1e-8)
+    f1 = 2 * precision * recall / (precision + recall + 1e-8)
+    return {'recall': recall, 'precision': precision, 'f1': f1}
+
+
+def resample_totals(
+        counts: list[np.ndarray],
+        n_resamples: int,
+        seed: int = 0,
+        chunk_size: int = 1 << 24,
+) -> list[np.ndarray]:
+    """
+    Totals of the `(n, 3)` tp/fp/fn `counts` over `n_resamples` resamples of the samples with replacement.
+    All arrays in `counts` are resampled with the same indices, so that runs over the same data stay paired.
+    """
+    n = len(counts[0])
+    # Samples only differ by their counts, and there are few distinct ones. Drawing how many times each distinct
+    # row is picked from a multinomial is the same as resampling the samples, without touching every sample.
+    rows, sizes = np.unique(np.concatenate(counts, axis=1), axis=0, return_counts=True)
+    rng = np.random.default_rng(seed)
+    totals = np.empty((n_resamples, rows.shape[1]), dtype=np.int64)
+    step = max(chunk_size // len(rows), 1)
+    for start in range(0, n_resamples, step):
+        end = min(start + step, n_resamples)
+        totals[start:end] = rng.multinomial(n, sizes / n, size=end - start) @ rows
+    return np.split(totals, len(counts), axis=1)
+
+
+def interval(values: np.ndarray, confidence: float) -> tuple[float, float]:
+    low, high = np.quantile(values, [(1 - confidence) / 2, (1 + confidence) / 2])
+    return float(low), float(high)
+
+
+def bootstrap(counts: np.ndarray, n_resamples: int, confidence: float, seed: int = 0) -> dict[str, tuple[float, float]]:
+    """Percentile confidence intervals of the metrics of a run from its per-sample `(n, 3)` tp/fp/fn counts"""
+    totals, = resample_totals([counts], n_resamples, seed)
+    resampled = metrics(*totals.T)
+    return {name: interval(values, confidence) for name, values in resampled.items()}
+
+
+def paired_bootstrap(
+        counts: np.ndarray,
+        baseline_counts: np.ndarray,
+        n_resamples: int,
+        confidence: float,
+        seed: int = 0,
+) -> dict[str, tuple[float, float, float, float]]:
+    """
+    Difference of every metric between a run and a baseline run over the same samples, as
+    `(difference, low, high, p_value)`, `p_value` being the share of resamples where the run is not better
+    """
+    if counts.shape != baseline_counts.shape:
+        raise ValueError(f'Runs are not over the same samples: {len(counts)} and {len(baseline_counts)} samples')
+    totals, baseline_totals = resample_totals([counts, baseline_counts], n_resamples, seed)
+    point = metrics(*counts.sum(axis=0))
+    baseline_point = metrics(*baseline_counts.sum(axis=0))
+    resampled = metrics(*totals.T)
+    baseline_resampled = metrics(*baseline_totals.T)
+    result = {}
+    for name in resampled:
+        differences = resampled[name] - baseline_resampled[name]
+        result[name] = (
+            float(point[name] - baseline_point[name]),
+            *interval(differences, confidence),
+            float(np.mean(differences <= 0)),
+        )
+    return result
+
+
+def save_counts(path: str | pathlib.Path, indices: np.ndarray, counts: np.ndarray):
+    np.savez_compressed(path, indices=indices, counts=counts)
+
+
+def load_counts(path: str | pathlib.Path) -> tuple[np.ndarray, np.ndarray]:
+    """Per-sample counts saved with a report, `path` being the report directory or the file itself"""
+    path = pathlib.Path(path)
+    if path.is_dir():
+        path = path / SAMPLE_COUNTS_FILE
+    with np.load(path) as data:
+        return data['indices'], data['counts']
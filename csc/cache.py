@@ -0,0 +1,36 @@
+import typing
+import pathlib
+import sqlite3
+
+
+class SQLiteCache:
+    """
+    A persistent key-value store of bytes, used to keep results between runs.
+    """
+
+    def __init__(self, path: str | pathlib.Path, table: str = 'cache'):
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.table = table
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(f'CREATE TABLE IF NOT EXISTS {self.table} (key BLOB PRIMARY KEY, value BLOB NOT NULL)')
+
+    def get_many(self, keys: typing.Sequence[bytes]) -> dict[bytes, bytes]:
+        found = {}
+        # Stay below the default limit of SQLite host parameters
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self.connection.execute(
+                f'SELECT key, value FROM {self.table} WHERE key IN ({", ".join("?" * len(chunk))})',
+                chunk,
+            )
+            found.update(rows)
+        return found
+
+    def put_many(self, items: typing.Iterable[tuple[bytes, bytes]]):
+        with self.connection:
+            self.connection.executemany(f'INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)', items)
+
+    def close(self):
+        self.connection.close()
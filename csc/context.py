@@ -0,0 +1,461 @@
+import os
+import mmap
+import array
+import bisect
+import typing
+import hashlib
+import pathlib
+import sqlite3
+import collections.abc
+
+import numpy as np
+
+
+def suffix_array(text: str) -> list[int]:
+    """Build the suffix array of `text` by prefix doubling, ordering suffixes like Python compares strings."""
+    n = len(text)
+    if n == 0:
+        return []
+    rank = [ord(char) for char in text]
+    sa = list(range(n))
+    k = 1
+    while True:
+        def key(i: int) -> tuple[int, int]:
+            return rank[i], rank[i + k] if i + k < n else -1
+
+        sa.sort(key=key)
+        new_rank = [0] * n
+        for j in range(1, n):
+            new_rank[sa[j]] = new_rank[sa[j - 1]] + (key(sa[j]) != key(sa[j - 1]))
+        rank = new_rank
+        if rank[sa[-1]] == n - 1 or k >= n:
+            return sa
+        k <<= 1
+
+
+def _has_border(string: str) -> bool:
+    return any(string[:length] == string[-length:] for length in range(1, len(string)))
+
+
+class IndexedContext:
+    """
+    A single context of a `ContextIndex`, usable wherever the filter expects the context string.
+    """
+
+    def __init__(self, index: 'ContextIndex', start: int, length: int):
+        self.index = index
+        self.start = start
+        self.length = length
+        self._counts = {}
+        self._text = None
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __str__(self) -> str:
+        return self.index.text(self.start, self.start + self.length)
+
+    def __getitem__(self, key: slice) -> str:
+        start, stop, _ = key.indices(self.length)
+        return self.index.text(self.start + start, self.start + stop)
+
+    def _range(self, substr: str) -> tuple[int, int]:
+        # Big-endian UTF-32 bytes sort like the code points they encode, so suffixes are compared without decoding
+        pattern = substr.encode('utf-32-be')
+        text, size = self.index.raw_text, len(pattern)
+        start, end = self.start * 4, (self.start + self.length) * 4
+
+        def prefix(position: int) -> bytes:
+            offset = start + position * 4
+            return text[offset:min(offset + size, end)]
+
+        sa = self.index.sa[self.start:self.start + self.length]
+        lo = bisect.bisect_left(sa, pattern, key=prefix)
+        hi = bisect.bisect_right(sa, pattern, lo=lo, key=prefix)
+        return lo, hi
+
+    def count(self, substr: str) -> int:
+        """Same as `str.count`, i.e. the number of non-overlapping occurrences, found by binary search."""
+        if not substr:
+            return self.length + 1
+        if substr in self._counts:
+            return self._counts[substr]
+        if self.length <= self.index.scan_length:
+            # Short contexts are cheaper to scan than to binary search
+            if self._text is None:
+                self._text = str(self)
+            self._counts[substr] = self._text.count(substr)
+            return self._counts[substr]
+        lo, hi = self._range(substr)
+        n = hi - lo
+        if n > 1 and _has_border(substr):
+            # Occurrences of self-overlapping substrings may overlap, count them greedily from the left like `str.count`
+            n, end = 0, 0
+            for position in sorted(self.index.sa[self.start + lo:self.start + hi]):
+                if position >= end:
+                    n += 1
+                    end = position + len(substr)
+        self._counts[substr] = n
+        return n
+
+
+class ContextIndex:
+    """
+    Suffix arrays over the contexts of a `FilterConfig`, stored on disk and memory-mapped.
+
+    The directory holds all contexts as big-endian UTF-32 text (`text.u32be`), one suffix array per context
+    (`sa.i32`) and the location of every context id (`meta.i64`). `get` has the same signature as `dict.get`, so an
+    index can replace `FilterConfig.context_dict`; the returned contexts answer `count` in logarithmic time.
+
+    Contexts of at most `scan_length` characters are decoded once and counted with `str.count` instead. The binary
+    search runs in Python and costs about 20 to 30 µs per count whatever the length, while `str.count` scans about
+    a character per 2 ns, so the suffix array only pays off beyond 8K to 16K characters. The default of 4096 stays
+    below that crossover to bound the decoded texts kept by the cache (`cache_size` contexts of `scan_length`
+    characters at most): typical news articles are scanned, and the suffix array serves the long documents whose
+    scan would dominate the evaluation.
+    """
+    text_file = 'text.u32be'
+    sa_file = 'sa.i32'
+    meta_file = 'meta.i64'
+
+    def __init__(self, path: str | pathlib.Path, cache_size: int = 1024, scan_length: int = 4096):
+        self.path = pathlib.Path(path)
+        self.cache_size = cache_size
+        self.scan_length = scan_length
+        self._open()
+
+    @classmethod
+    def build(cls, context_dict: dict[int, str], path: str | pathlib.Path) -> 'ContextIndex':
+        path = pathlib.Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        meta = array.array('q')
+        start = 0
+        with (path / cls.text_file).open('wb') as text_file, (path / cls.sa_file).open('wb') as sa_file:
+            for context_id in sorted(context_dict):
+                context = context_dict[context_id]
+                text_file.write(context.encode('utf-32-be'))
+                array.array('i', suffix_array(context)).tofile(sa_file)
+                meta.extend((context_id, start, len(context)))
+                start += len(context)
+        with (path / cls.meta_file).open('wb') as meta_file:
+            meta.tofile(meta_file)
+        return cls(path)
+
+    @classmethod
+    def is_fresh(cls, path: str | pathlib.Path, source: str | pathlib.Path) -> bool:
+        path, source = pathlib.Path(path), pathlib.Path(source)
+        if not (path / cls.meta_file).exists():
+            return False
+        return os.path.getmtime(path / cls.meta_file) >= os.path.getmtime(source)
+
+    def _open(self):
+        meta = array.array('q')
+        meta.frombytes((self.path / self.meta_file).read_bytes())
+        self.locations = {meta[i]: (meta[i + 1], meta[i + 2]) for i in range(0, len(meta), 3)}
+        # Recently used contexts keep their memoized counts, sentences of one article are usually evaluated together
+        self._contexts = collections.OrderedDict()
+        self._files, self._maps = [], []
+        self.raw_text = self._map(self.text_file)
+        sa = self._map(self.sa_file)
+        self.sa = memoryview(sa).cast('i') if sa is not None else []
+
+    def _map(self, name: str) -> mmap.mmap | None:
+        file = (self.path / name).open('rb')
+        self._files.append(file)
+        if os.fstat(file.fileno()).st_size == 0:
+            return None
+        self._maps.append(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+        return self._maps[-1]
+
+    def close(self):
+        if isinstance(self.sa, memoryview):
+            self.sa.release()
+        for map_ in self._maps:
+            map_.close()
+        for file in self._files:
+            file.close()
+
+    def __getstate__(self) -> dict:
+        return {'path': self.path, 'cache_size': self.cache_size, 'scan_length': self.scan_length}
+
+    def __setstate__(self, state: dict):
+        self.path = state['path']
+        self.cache_size = state['cache_size']
+        self.scan_length = state['scan_length']
+        self._open()
+
+    def text(self, start: int, end: int) -> str:
+        if start >= end:
+            return ''
+        return self.raw_text[start * 4:end * 4].decode('utf-32-be')
+
+    def __contains__(self, context_id: int) -> bool:
+        return context_id in self.locations
+
+    def __len__(self) -> int:
+        return len(self.locations)
+
+    def __getitem__(self, context_id: int) -> IndexedContext:
+        if context_id in self._contexts:
+            self._contexts.move_to_end(context_id)
+            return self._contexts[context_id]
+        context = IndexedContext(self, *self.locations[context_id])
+        self._contexts[context_id] = context
+        if len(self._contexts) > self.cache_size:
+            self._contexts.popitem(last=False)
+        return context
+
+    def get(self, context_id: int, default: typing.Any = None) -> IndexedContext | typing.Any:
+        if context_id not in self.locations:
+            return default
+        return self[context_id]
+
+
+def sentence_hash(sentence: str) -> int:
+    return int.from_bytes(hashlib.blake2b(sentence.encode('utf-8', 'surrogatepass'), digest_size=8).digest(), 'little')
+
+
+class SentenceIndex:
+    """
+    The context id of every sentence, replacing `FilterConfig.query_dict` without holding the sentences.
+
+    The directory holds the sorted 64-bit hashes of the sentences (`hashes.npy`) and, for each hash, the context id
+    and the offsets of the sentence in that context (`locations.npy`), both memory-mapped. A lookup binary searches
+    the hash and checks that the context really holds the sentence at these offsets, so that hash collisions never
+    return a wrong context. Sentences which are not found in their context are checked by their hash only.
+    """
+    hashes_file = 'hashes.npy'
+    locations_file = 'locations.npy'
+
+    def __init__(self, path: str | pathlib.Path, contexts: typing.Mapping[int, typing.Any]):
+        self.path = pathlib.Path(path)
+        self.contexts = contexts
+        self._open()
+
+    @classmethod
+    def build(
+            cls,
+            query_dict: typing.Mapping[str, int],
+            context_dict: typing.Mapping[int, typing.Any],
+            path: str | pathlib.Path,
+    ) -> 'SentenceIndex':
+        path = pathlib.Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        hashes = np.empty(len(query_dict), dtype=np.uint64)
+        locations = np.empty((len(query_dict), 3), dtype=np.int64)
+        for i, (sentence, context_id) in enumerate(query_dict.items()):
+            start = str(context_dict.get(context_id, '')).find(sentence)
+            end = start + len(sentence) if start >= 0 else -1
+            hashes[i] = sentence_hash(sentence)
+            locations[i] = context_id, start, end
+        order = np.argsort(hashes, kind='stable')
+        np.save(path / cls.locations_file, locations[order])
+        # Written last, its mtime tells whether the index is fresh
+        np.save(path / cls.hashes_file, hashes[order])
+        return cls(path, context_dict)
+
+    @classmethod
+    def is_fresh(cls, path: str | pathlib.Path, source: str | pathlib.Path) -> bool:
+        path, source = pathlib.Path(path), pathlib.Path(source)
+        if not (path / cls.hashes_file).exists():
+            return False
+        return os.path.getmtime(path / cls.hashes_file) >= os.path.getmtime(source)
+
+    def _open(self):
+        self.hashes = np.load(self.path / self.hashes_file, mmap_mode='r')
+        self.locations = np.load(self.path / self.locations_file, mmap_mode='r')
+
+    def __getstate__(self) -> dict:
+        return {'path': self.path, 'contexts': self.contexts}
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._open()
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def __contains__(self, sentence: str) -> bool:
+        return self.get(sentence) is not None
+
+    def __getitem__(self, sentence: str) -> int:
+        context_id = self.get(sentence)
+        if context_id is None:
+            raise KeyError(sentence)
+        return context_id
+
+    def get(self, sentence: str, default: typing.Any = None) -> int | typing.Any:
+        key = np.uint64(sentence_hash(sentence))
+        i = int(np.searchsorted(self.hashes, key))
+        while i < len(self.hashes) and self.hashes[i] == key:
+            context_id, start, end = self.locations[i].tolist()
+            if start < 0:
+                return context_id
+            context = self.contexts.get(context_id)
+            if context is not None and context[start:end] == sentence:
+                return context_id
+            i += 1
+        return default
+
+
+class _StoreMapping(collections.abc.Mapping):
+    """A read-only view of a table of a `ContextStore`, usable wherever the filter expects a dict"""
+
+    def __init__(self, store: 'ContextStore', table: str, key: str, value: str):
+        self.store = store
+        self.table = table
+        self.key = key
+        self.value = value
+
+    def _fetch(self, key: typing.Any) -> typing.Any:
+        row = self.store.connection.execute(
+            f'SELECT {self.value} FROM {self.table} WHERE {self.key} = ?', (key,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return row[0]
+
+    def __getitem__(self, key: typing.Any) -> typing.Any:
+        return self._fetch(key)
+
+    def __iter__(self) -> typing.Iterator:
+        for row in self.store.connection.execute(f'SELECT {self.key} FROM {self.table} ORDER BY {self.key}'):
+            yield row[0]
+
+    def __len__(self) -> int:
+        return self.store.connection.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+
+    def __bool__(self) -> bool:
+        return self.store.connection.execute(f'SELECT 1 FROM {self.table} LIMIT 1').fetchone() is not None
+
+
+class _StoreContexts(_StoreMapping):
+
+    def __getitem__(self, context_id: int) -> str:
+        # Sentences of one article are usually evaluated together, recently used articles are kept in memory
+        contexts = self.store.contexts_cache
+        if context_id in contexts:
+            contexts.move_to_end(context_id)
+            return contexts[context_id]
+        context = self._fetch(context_id)
+        contexts[context_id] = context
+        if len(contexts) > self.store.cache_size:
+            contexts.popitem(last=False)
+        return context
+
+
+class ContextStore:
+    """
+    Contexts and queries of a `FilterConfig` in an SQLite database, read lazily.
+
+    `contexts` maps context ids to texts and `queries` maps sentences to context ids, both indexed by their keys,
+    so that opening a store costs nothing and only the contexts of the evaluated sentences are ever read.
+    They replace `FilterConfig.context_dict` and `FilterConfig.query_dict`.
+    """
+    schema = (
+        'CREATE TABLE IF NOT EXISTS contexts (id INTEGER PRIMARY KEY, text TEXT NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS queries (sentence TEXT PRIMARY KEY, context_id INTEGER NOT NULL) WITHOUT ROWID',
+    )
+
+    def __init__(self, path: str | pathlib.Path, cache_size: int = 1024):
+        self.path = pathlib.Path(path)
+        self.cache_size = cache_size
+        self.contexts = _StoreContexts(self, 'contexts', 'id', 'text')
+        self.queries = _StoreMapping(self, 'queries', 'sentence', 'context_id')
+        self._open()
+
+    @classmethod
+    def build(
+            cls,
+            path: str | pathlib.Path,
+            context_dict: typing.Mapping[int, str],
+            query_dict: typing.Mapping[str, int],
+    ) -> 'ContextStore':
+        with ContextStoreWriter(path) as writer:
+            for context_id, context in context_dict.items():
+                writer.context_dict[context_id] = context
+            for sentence, context_id in query_dict.items():
+                writer.query_dict[sentence] = context_id
+        return cls(path)
+
+    def _open(self):
+        if not self.path.exists():
+            raise FileNotFoundError(self.path)
+        self.connection = sqlite3.connect(f'{self.path.resolve().as_uri()}?mode=ro', uri=True, check_same_thread=False)
+        self.contexts_cache = collections.OrderedDict()
+
+    def close(self):
+        self.connection.close()
+
+    def __getstate__(self) -> dict:
+        return {'path': self.path, 'cache_size': self.cache_size, 'contexts': self.contexts, 'queries': self.queries}
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._open()
+
+
+class _SQLiteDictWriter:
+    """Inserts the entries set on it in batches, later values overwriting earlier ones like in a dict"""
+
+    def __init__(self, connection: sqlite3.Connection, table: str, columns: tuple[str, str], batch_size: int = 10000):
+        self.connection = connection
+        self.statement = f'INSERT OR REPLACE INTO {table} ({", ".join(columns)}) VALUES (?, ?)'
+        self.batch_size = batch_size
+        self.batch = []
+        self.n_items = 0
+
+    def __setitem__(self, key, value):
+        self.batch.append((key, value))
+        self.n_items += 1
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self.connection.executemany(self.statement, self.batch)
+        self.batch = []
+
+
+class ContextStoreWriter:
+    """
+    Streams contexts and queries into a `ContextStore`, with the same interface as `csc.data.base.ContextWriter`.
+    The database is written next to its path and only moved into place once complete.
+    """
+
+    def __init__(self, path: str | pathlib.Path):
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.tmp_path = self.path.with_name(self.path.name + '.tmp')
+        self.tmp_path.unlink(missing_ok=True)
+        self.connection = sqlite3.connect(self.tmp_path)
+        self.connection.execute('PRAGMA journal_mode=OFF')
+        self.connection.execute('PRAGMA synchronous=OFF')
+        for statement in ContextStore.schema:
+            self.connection.execute(statement)
+        self.context_dict = _SQLiteDictWriter(self.connection, 'contexts', ('id', 'text'))
+        self.query_dict = _SQLiteDictWriter(self.connection, 'queries', ('sentence', 'context_id'))
+
+    def abort(self):
+        self.connection.close()
+        self.tmp_path.unlink()
+
+    def close(self):
+        self.context_dict.flush()
+        self.query_dict.flush()
+        self.connection.commit()
+        self.connection.close()
+        if not self.context_dict.n_items or not self.query_dict.n_items:
+            self.tmp_path.unlink()
+            print('No context or query data to save.')
+            return
+        os.replace(self.tmp_path, self.path)
+        print(f'Context and query data saved to {self.path.resolve().absolute()}.')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
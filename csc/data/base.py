@@ -1,7 +1,13 @@
+import os
+import re
 import abc
 import json
 import pickle
+import shutil
+import typing
+import hashlib
 import pathlib
+import itertools
 import dataclasses
 
 import csc
@@ -133,13 +139,13 @@ templates = [
 
 
 def print_save_log(
-        data: list[DatasetItem],
+        n_samples: int,
         max_input_length: int,
         max_full_length: int,
         path: pathlib.Path,
 ):
     print(csc.prettify({
-        'n_samples': len(data),
+        'n_samples': n_samples,
         'max_input_length': max_input_length,
         'max_full_length': max_full_length,
         'path': path.resolve().absolute(),
@@ -154,23 +160,257 @@ def count_data_length(data: DatasetItem) -> tuple[int, int]:
     return input_length, input_length + (_count_length(data.output) if data.output else 0)
 
 
+def split_key(item: DatasetItem, train_test_split: float) -> str:
+    """
+    Assign an item to the train or the test split from a hash of its text, so that the split can be decided
+    while streaming, is the same on every run, and puts duplicated sentences on the same side
+    """
+    text = ''.join(part or '' for part in (item.system, item.instruction, item.input))
+    digest = hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest()
+    return csc.TRAIN if int.from_bytes(digest, 'big') < train_test_split * 2 ** 64 else csc.TEST
+
+
+COMPACT_FORMAT = 'csc-compact-jsonl'
+COMPACT_SUFFIX = '.compact.jsonl'
+# Fields which hold the prompt of a template rather than the sentence, depending on the template
+COMPACT_FIELDS = ('system', 'instruction')
+# The prompts of all the templates, defined once in the header of a compact file and referenced by their index
+TEMPLATE_STRINGS = list(dict.fromkeys(
+    getattr(template, name)
+    for template in templates
+    for name in COMPACT_FIELDS
+    if isinstance(getattr(template, name, None), str)
+))
+_TEMPLATE_STRINGS = {string: string for string in TEMPLATE_STRINGS}
+_COMPACT_REFERENCE_PATTERN = re.compile(rf'"({"|".join(COMPACT_FIELDS)})": (\d+)')
+
+
+def compact_header() -> dict:
+    return {'format': COMPACT_FORMAT, 'strings': TEMPLATE_STRINGS}
+
+
+def is_compact_header(record: dict) -> bool:
+    return record.get('format') == COMPACT_FORMAT
+
+
+def iter_dataset_file(path: str | pathlib.Path) -> typing.Iterator[dict]:
+    """
+    Records of a dataset file, compact or not, in the LlamaFactory layout.
+    Prompts are interned: all the records share the same string objects instead of holding their own copies.
+    """
+    records = csc.iter_file(path, 'jsonl')
+    first = next(records, None)
+    if first is None:
+        return
+    if is_compact_header(first):
+        strings = [_TEMPLATE_STRINGS.get(string, string) for string in first['strings']]
+        for record in records:
+            for field in COMPACT_FIELDS:
+                if isinstance(record.get(field), int):
+                    record[field] = strings[record[field]]
+            yield record
+        return
+    for record in itertools.chain([first], records):
+        for field in COMPACT_FIELDS:
+            if field in record:
+                record[field] = _TEMPLATE_STRINGS.get(record[field], record[field])
+        yield record
+
+
+def expand_compact_file(path: str | pathlib.Path, output_path: str | pathlib.Path, chunk_size: int = 1 << 22) -> int:
+    """
+    Write a compact dataset file as the JSONL file `DatasetWriter` would have written, returning the number of
+    records. References are replaced in the text of the rows, which are never decoded: inside JSON strings quotes
+    are escaped, so a reference can only be a key of the row.
+    """
+    n_records = 0
+    with pathlib.Path(path).open() as f, pathlib.Path(output_path).open('w') as output:
+        header = json.loads(f.readline())
+        if not is_compact_header(header):
+            raise ValueError(f'{path} is not a compact dataset file')
+        encoded = [json.dumps(string, ensure_ascii=False) for string in header['strings']]
+
+        def expand(match: re.Match) -> str:
+            return f'"{match[1]}": {encoded[int(match[2])]}'
+
+        while lines := f.readlines(chunk_size):
+            output.write(_COMPACT_REFERENCE_PATTERN.sub(expand, ''.join(lines)))
+            n_records += len(lines)
+    return n_records
+
+
+class DatasetWriter:
+    """
+    Writes dataset items to one JSONL file per split as they come, keeping only the statistics in memory.
+    With `compact`, the prompts of the templates are written once in a header line and the rows reference them.
+    """
+
+    def __init__(self, path: pathlib.Path, variant: str | None = None, compact: bool = False):
+        self.path = path
+        self.variant = variant
+        self.compact = compact
+        self.string_ids = {string: i for i, string in enumerate(TEMPLATE_STRINGS)}
+        self.files = {}
+        self.stats = {}
+
+    def get_path(self, key: str) -> pathlib.Path:
+        suffix = COMPACT_SUFFIX if self.compact else '.jsonl'
+        if self.variant:
+            return self.path / f'{self.variant}-{key}{suffix}'
+        return self.path / f'{key}{suffix}'
+
+    def open(self, key: str) -> typing.TextIO | None:
+        """Open the file of a split on its first item, `None` if it already exists and must not be overwritten"""
+        if key not in self.files:
+            path = self.get_path(key)
+            self.files[key] = None
+            if path.exists():
+                print(f'File {path} already exists. Overwrite? (y/[n])')
+                if input().lower() != 'y':
+                    return None
+            self.path.mkdir(parents=True, exist_ok=True)
+            self.files[key] = path.open('w')
+            if self.compact:
+                self.files[key].write(json.dumps(compact_header(), ensure_ascii=False) + '\n')
+            self.stats[key] = [0, 0, 0]
+        return self.files[key]
+
+    def write(self, key: str, item: DatasetItem):
+        file = self.open(key)
+        if file is None:
+            return
+        record = csc.dataclass_to_cleaned_dict(item)
+        if self.compact:
+            for field in COMPACT_FIELDS:
+                if field in record and record[field] in self.string_ids:
+                    record[field] = self.string_ids[record[field]]
+        file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        input_length, full_length = count_data_length(item)
+        stats = self.stats[key]
+        stats[0] += 1
+        stats[1] = max(stats[1], input_length)
+        stats[2] = max(stats[2], full_length)
+
+    def close(self):
+        for key, file in self.files.items():
+            if file is not None:
+                file.close()
+                print_save_log(*self.stats[key], self.get_path(key))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class PickledDictWriter:
+    """
+    Writes a dict to a pickle file entry by entry, so that it never has to be held in memory.
+    The result is read back with `pickle.load` like a pickled dict, later values overwriting earlier ones.
+    """
+
+    def __init__(self, file: typing.BinaryIO):
+        self.file = file
+        self.n_items = 0
+        self.file.write(pickle.PROTO + b'\x02' + pickle.EMPTY_DICT)
+
+    @staticmethod
+    def _dumps(obj) -> bytes:
+        # A protocol 2 pickle without its header and its stop opcode, which leaves the object on the stack
+        return pickle.dumps(obj, protocol=2)[2:-1]
+
+    def __setitem__(self, key, value):
+        self.file.write(self._dumps(key) + self._dumps(value) + pickle.SETITEM)
+        self.n_items += 1
+
+    def close(self):
+        self.file.write(pickle.STOP)
+
+
+class ContextWriter:
+    """
+    Streams contexts and queries into the context file read by `csc.load_file`, i.e. the pickled `context_dict`
+    followed by the pickled `query_dict`. Queries are spooled to a temporary file until the contexts are done.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.tmp_path = path.with_name(path.name + '.tmp')
+        self.spool_path = path.with_name(path.name + '.query.tmp')
+        self.context_file = self.tmp_path.open('wb')
+        self.query_file = self.spool_path.open('w+b')
+        self.context_dict = PickledDictWriter(self.context_file)
+        self.query_dict = PickledDictWriter(self.query_file)
+
+    def abort(self):
+        self.context_file.close()
+        self.query_file.close()
+        self.tmp_path.unlink()
+        self.spool_path.unlink()
+
+    def close(self):
+        self.context_dict.close()
+        self.query_dict.close()
+        self.query_file.seek(0)
+        shutil.copyfileobj(self.query_file, self.context_file)
+        self.context_file.close()
+        self.query_file.close()
+        self.spool_path.unlink()
+        if not self.context_dict.n_items or not self.query_dict.n_items:
+            self.tmp_path.unlink()
+            print('No context or query data to save.')
+            return
+        os.replace(self.tmp_path, self.path)
+        print(f'Context and query data saved to {self.path.resolve().absolute()}.')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
 class Dataset(abc.ABC):
 
-    def __init__(self, config: dict, template: int, variant: str | None = None):
+    def __init__(self, config: dict, template: int, variant: str | None = None, workers: int = 1):
         self.config = config
         self.template = template
         self.variant = variant
+        self.workers = workers
         self.data = {}
         self.context_dict = {}
         self.query_dict = {}
 
     @abc.abstractmethod
-    def load_data(self):
+    def iter_data(self) -> typing.Iterator[tuple[str, DatasetItem]]:
+        """
+        Yield `(key, item)` pairs as they are loaded.
+        Contexts and queries are set on `self.context_dict` and `self.query_dict` along the way.
+        """
         raise NotImplementedError
 
+    def load_data(self):
+        for key, item in self.iter_data():
+            self.data.setdefault(key, []).append(item)
+
     def get_file_path(self, key: str) -> pathlib.Path:
         return pathlib.Path(self.config['root']) / self.config['files'][key]
 
+    def get_save_path(self, root: str | pathlib.Path) -> pathlib.Path:
+        return pathlib.Path(root) / self.config['name'] / f'template-{self.template}'
+
+    def get_context_path(self, root: str | pathlib.Path, store: bool = False) -> pathlib.Path:
+        path = pathlib.Path(root) / self.config['name']
+        suffix = '.sqlite' if store else '.pkl'
+        if self.variant:
+            return path / f'{self.variant}-context{suffix}'
+        return path / f'context{suffix}'
+
     def split_data(self, train_test_split: float | None):
         if train_test_split is None:
             return
@@ -179,42 +419,47 @@ class Dataset(abc.ABC):
         self.data[csc.TEST] = all_data[int(len(all_data) * train_test_split):]
 
     def save_data(self, root: str | pathlib.Path):
-        path = pathlib.Path(root) / self.config['name']
         for key, data in self.data.items():
-            self._save_data(data, path, key)
+            self._save_data(data, key, root)
 
-    def _save_data(self, data: list[DatasetItem], path: pathlib.Path, key: str):
-        path /= f'template-{self.template}'
-        path.mkdir(parents=True, exist_ok=True)
-        max_input_length, max_full_length = 0, 0
-        if self.variant:
-            path = path / f'{self.variant}-{key}.jsonl'
-        else:
-            path = path / f'{key}.jsonl'
-        if path.exists():
-            print(f'File {path} already exists. Overwrite? (y/[n])')
-            if input().lower() != 'y':
-                return
-        with path.open('w') as file:
+    def _save_data(self, data: list[DatasetItem], key: str, root: str | pathlib.Path):
+        with DatasetWriter(self.get_save_path(root), self.variant) as writer:
             for item in data:
-                text = json.dumps(csc.dataclass_to_cleaned_dict(item), ensure_ascii=False) + '\n'
-                input_length, full_length = count_data_length(item)
-                max_input_length = max(max_input_length, input_length)
-                max_full_length = max(max_full_length, full_length)
-                file.write(text)
-        print_save_log(data, max_input_length, max_full_length, path)
-
-    def save_context(self, root:str | pathlib.Path):
+                writer.write(key, item)
+
+    def save_context(self, root: str | pathlib.Path):
         if not self.context_dict or not self.query_dict:
             print('No context or query data to save.')
             return
-        path = pathlib.Path(root) / self.config['name']
-        path.mkdir(parents=True, exist_ok=True)
-        if self.variant:
-            path = path / f'{self.variant}-context.pkl'
-        else:
-            path = path / 'context.pkl'
+        path = self.get_context_path(root)
+        path.parent.mkdir(parents=True, exist_ok=True)
         with path.open('wb') as file:
             pickle.dump(self.context_dict, file)
             pickle.dump(self.query_dict, file)
         print(f'Context and query data saved to {path.resolve().absolute()}.')
+
+    def build(
+            self,
+            output_root: str | pathlib.Path,
+            context_root: str | pathlib.Path,
+            train_test_split: float | None = None,
+            compact: bool = False,
+            context_store: bool = False,
+    ):
+        """
+        Load, split and save the dataset and its contexts in one streaming pass.
+        Items and contexts are written as they are produced, so memory does not grow with the corpus. Items of the
+        `all` split are also assigned to the train or the test split by `split_key`.
+        With `context_store`, the contexts are written to a `csc.context.ContextStore` instead of a pickle file.
+        """
+        context_path = self.get_context_path(context_root, context_store)
+        context_writer_class = csc.context.ContextStoreWriter if context_store else ContextWriter
+        with (
+            DatasetWriter(self.get_save_path(output_root), self.variant, compact) as writer,
+            context_writer_class(context_path) as context_writer,
+        ):
+            self.context_dict, self.query_dict = context_writer.context_dict, context_writer.query_dict
+            for key, item in self.iter_data():
+                writer.write(key, item)
+                if key == csc.ALL and train_test_split is not None:
+                    writer.write(split_key(item, train_test_split), item)
@@ -1,21 +1,21 @@
 import tqdm
+import typing
 
 import csc
 
-from csc.data.base import Dataset
+from csc.data.base import Dataset, DatasetItem
 
 
 class CSCDNSDataset(Dataset):
 
-    def load_data(self):
+    def iter_data(self) -> typing.Iterator[tuple[str, DatasetItem]]:
         if self.variant == 'reasoning':
-            self._load_data(csc.load_file(self.get_file_path(csc.TEST)), csc.TEST)
+            yield from self._iter_data(csc.iter_file(self.get_file_path(csc.TEST)), csc.TEST)
         else:
-            self._load_data(csc.load_file(self.get_file_path(csc.TRAIN)), csc.TRAIN)
-            self._load_data(csc.load_file(self.get_file_path(csc.TEST)), csc.TEST)
+            yield from self._iter_data(csc.iter_file(self.get_file_path(csc.TRAIN)), csc.TRAIN)
+            yield from self._iter_data(csc.iter_file(self.get_file_path(csc.TEST)), csc.TEST)
 
-    def _load_data(self, data: list, key: str):
-        self.data[key] = []
+    def _iter_data(self, data: typing.Iterable[str], key: str) -> typing.Iterator[tuple[str, DatasetItem]]:
         for line in tqdm.tqdm(data, desc=f'Loading {key} data'):
             has_error, text_with_errors, text_corrected = line.split('\t')
             if not csc.data.utils.compare_string_length_and_warn(text_with_errors, text_corrected):
@@ -25,4 +25,4 @@ class CSCDNSDataset(Dataset):
             item = template.process_string(text_with_errors, errors)
             item.extra_info.corrected = text_corrected
             item.extra_info.has_error = len(errors) > 0
-            self.data[key].append(item)
+            yield key, item
@@ -1,17 +1,17 @@
 import tqdm
+import typing
 
 import csc
 
-from csc.data.base import Dataset
+from csc.data.base import Dataset, DatasetItem
 
 
 class LemonV2Dataset(Dataset):
 
-    def load_data(self):
+    def iter_data(self) -> typing.Iterator[tuple[str, DatasetItem]]:
         keys = self.config['files'].keys()
         for key in keys:
-            self.data[key] = []
-            data = csc.load_file(self.get_file_path(key))
+            data = csc.iter_file(self.get_file_path(key))
             for line in tqdm.tqdm(data, desc=f'Loading {key} data'):
                 text_with_errors, text_corrected = line.split('\t')
                 text_with_errors, text_corrected = text_with_errors.replace(' ', ''), text_corrected.replace(' ', '')
@@ -22,4 +22,4 @@ class LemonV2Dataset(Dataset):
                 item = template.process_string(text_with_errors, errors)
                 item.extra_info.corrected = text_corrected
                 item.extra_info.has_error = len(errors) > 0
-                self.data[key].append(item)
+                yield key, item
@@ -1,9 +1,14 @@
+import re
 import tqdm
+import typing
 import pathlib
+import itertools
+import collections
+import concurrent.futures
 
 import csc
 
-from csc.data.base import Dataset
+from csc.data.base import Dataset, DatasetItem
 
 
 blacklist = [
@@ -14,7 +19,39 @@ blacklist = [
 ]
 
 
+class Blacklist:
+    """
+    Rules of `blacklist` compiled into a single check: prefixes (`f`) and suffixes (`b`) are tested at once by
+    `str.startswith`/`str.endswith` and contained strings (`a`) by one regex.
+    """
+
+    def __init__(self, rules: list[tuple[str, str]]):
+        self.prefixes = tuple(text for kind, text in rules if kind == 'f')
+        self.suffixes = tuple(text for kind, text in rules if kind == 'b')
+        contained = [text for kind, text in rules if kind == 'a']
+        self.pattern = re.compile('|'.join(map(re.escape, contained))) if contained else None
+
+    def matches(self, text: str) -> bool:
+        if text.startswith(self.prefixes) or text.endswith(self.suffixes):
+            return True
+        return self.pattern is not None and self.pattern.search(text) is not None
+
+
+blacklist_matcher = Blacklist(blacklist)
+
+
 def should_output(text: str) -> bool:
+    if not text:
+        return False
+    if blacklist_matcher.matches(text):
+        return False
+    if len(text) < 10:
+        return False
+    return True
+
+
+def should_output_by_rules(text: str) -> bool:
+    """Same as `should_output`, walking the rules one by one"""
     if not text:
         return False
     for rule in blacklist:
@@ -40,32 +77,83 @@ def clean_text(text: str) -> str:
     return text
 
 
+def read_articles(files: list[pathlib.Path]) -> list[str]:
+    return [csc.load_file(file)['content'] for file in files]
+
+
+def process_article(content: str, template: int) -> list[tuple[str, DatasetItem]]:
+    """Split an article into the sentences to output, each with its dataset item"""
+    sentences = []
+    for sentence in csc.data.utils.split_sentences(content):
+        sentence = clean_text(sentence)
+        if should_output(sentence):
+            item = csc.data.base.templates[template].process_string(sentence, [])
+            item.output = None
+            sentences.append((sentence, item))
+    return sentences
+
+
+def process_articles(contents: list[str], template: int) -> list[list[tuple[str, DatasetItem]]]:
+    return [process_article(content, template) for content in contents]
+
+
 class STCNDataset(Dataset):
+    # Number of articles read and processed together by the workers of a parallel ingestion
+    batch_size = 64
 
-    def load_data(self):
-        self.data[csc.TEST] = []
+    def iter_data(self) -> typing.Iterator[tuple[str, DatasetItem]]:
         if self.variant in {'g3'}:
             for file in tqdm.tqdm(list(pathlib.Path(self.config['root']).rglob('*.txt'))):
-                data = csc.load_file(file)
+                data = csc.iter_file(file)
                 for line in tqdm.tqdm(data, desc=f'Loading data'):
                     text_with_errors, _ = line.split('\t\t\t')
                     template = csc.data.base.templates[self.template]
                     item = template.process_string(text_with_errors, [])
                     item.output = None
-                    self.data[csc.TEST].append(item)
+                    yield csc.TEST, item
         else:
-            content_id = 0
-            for file in tqdm.tqdm(list(pathlib.Path(self.config['root']).rglob('article.json'))):
-                data = csc.load_file(file)
-                content = data['content']
+            for content_id, content, sentences in self.iter_articles():
                 self.context_dict[content_id] = content
-                sentences = csc.data.utils.split_sentences(content)
-                for sentence in sentences:
-                    sentence = clean_text(sentence)
-                    if should_output(sentence):
-                        self.query_dict[sentence] = content_id
-                        template = csc.data.base.templates[self.template]
-                        item = template.process_string(sentence, [])
-                        item.output = None
-                        self.data[csc.TEST].append(item)
-                content_id += 1
+                for sentence, item in sentences:
+                    self.query_dict[sentence] = content_id
+                    yield csc.TEST, item
+
+    def iter_articles(self) -> typing.Iterator[tuple[int, str, list[tuple[str, DatasetItem]]]]:
+        """
+        Yield every article with its sentences, in the order of their paths.
+        The content id of an article is its position in that order, whether the articles are processed in parallel
+        """
+        files = sorted(pathlib.Path(self.config['root']).rglob('article.json'))
+        if self.workers <= 1:
+            articles = self._iter_articles_serial(files)
+        else:
+            articles = self._iter_articles_parallel(files)
+        for content_id, (content, sentences) in enumerate(tqdm.tqdm(articles, total=len(files))):
+            yield content_id, content, sentences
+
+    def _iter_articles_serial(self, files: list[pathlib.Path]) -> typing.Iterator[tuple[str, list]]:
+        for file in files:
+            content = csc.load_file(file)['content']
+            yield content, process_article(content, self.template)
+
+    def _iter_articles_parallel(self, files: list[pathlib.Path]) -> typing.Iterator[tuple[str, list]]:
+        # Reading is I/O-bound and done by threads, splitting and rendering is CPU-bound and done by processes.
+        # Batches are consumed in order and only a few of them are in flight, which keeps memory bounded.
+        n_in_flight = self.workers * 2
+        with (
+            concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as readers,
+            concurrent.futures.ProcessPoolExecutor(max_workers=self.workers) as processors,
+        ):
+            batches = (files[start:start + self.batch_size] for start in range(0, len(files), self.batch_size))
+            reads = collections.deque(
+                readers.submit(read_articles, batch) for batch in itertools.islice(batches, n_in_flight)
+            )
+            processing = collections.deque()
+            while reads or processing:
+                if reads:
+                    contents = reads.popleft().result()
+                    processing.append((contents, processors.submit(process_articles, contents, self.template)))
+                    reads.extend(readers.submit(read_articles, batch) for batch in itertools.islice(batches, 1))
+                if len(processing) >= n_in_flight or not reads:
+                    contents, future = processing.popleft()
+                    yield from zip(contents, future.result())
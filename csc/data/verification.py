@@ -1,5 +1,6 @@
 import json
 import tqdm
+import typing
 import pathlib
 
 import csc
@@ -125,8 +126,14 @@ class VerificationDataset:
         self.variant = variant
         self.data = {}
 
-    def load_data(self):
-        data = csc.load_file(self.path)
+    def load_data(self, data: typing.Iterable[dict] | None = None, indices: typing.Iterable[int] | None = None):
+        if indices is not None:
+            # Only fetch the candidates of the requested sentences instead of parsing the whole file
+            with csc.index.JSONLIndex(self.path) as index:
+                data = [item for i in dict.fromkeys(indices) for item in index.get(i, [])]
+        elif data is None:
+            data = csc.iter_file(self.path)
+        data = csc.expand_predictions(data)
         input_template = csc.evaluation.templates[self.input_template]
         output_template = templates[self.output_template]
         self.data[csc.TEST] = []
@@ -142,8 +149,8 @@ class VerificationDataset:
                     self.data[csc.TEST].append(
                         output_template.process_string(prompt, predict, label, reasoning)
                     )
-                prompt = input_template.clean_prompt(item['prompt'])
-                label = input_template.clean_label(item['label'])
+                prompt = input_template.item_prompt(item)
+                label = input_template.item_label(item)
                 predict = []
                 current_index = index
             predict.append(input_template.clean_predict(item['predict']))
@@ -177,4 +184,4 @@ class VerificationDataset:
                 max_input_length = max(max_input_length, input_length)
                 max_full_length = max(max_full_length, full_length)
                 file.write(text)
-        print_save_log(data, max_input_length, max_full_length, path)
+        print_save_log(len(data), max_input_length, max_full_length, path)
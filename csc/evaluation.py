@@ -1,7 +1,16 @@
 import re
 import abc
+import json
+import pickle
+import typing
+import hashlib
 import pathlib
+import functools
+import collections
 import dataclasses
+import concurrent.futures
+
+import numpy as np
 
 import csc
 
@@ -29,15 +38,71 @@ class FilterConfig:
     enabled: bool = False
     label_whitelist: set[str] = dataclasses.field(default_factory=set)
     predict_whitelist: set[str] = dataclasses.field(default_factory=set)
-    context_dict: dict[int, str] = dataclasses.field(default_factory=dict)
-    query_dict: dict[str, int] = dataclasses.field(default_factory=dict)
+    context_dict: typing.Mapping[int, str] = dataclasses.field(default_factory=dict)
+    query_dict: typing.Mapping[str, int] = dataclasses.field(default_factory=dict)
     context_threshold: int = 1
     context_compare_length: int = 2
     whitelist_compare_range: list[int] = dataclasses.field(default_factory=list)
+    # Read in place of `context_dict` and `query_dict` when they are not given
+    context_store: csc.context.ContextStore | None = None
 
     def __post_init__(self):
         if not self.whitelist_compare_range:
             self.whitelist_compare_range = [1, 3, 4, 5, 6]
+        if self.context_store is not None:
+            if isinstance(self.context_dict, dict) and not self.context_dict:
+                self.context_dict = self.context_store.contexts
+            if isinstance(self.query_dict, dict) and not self.query_dict:
+                self.query_dict = self.context_store.queries
+
+
+def load_filter_config(
+        label_whitelist_paths: list[str] | None = None,
+        predict_whitelist_paths: list[str] | None = None,
+        context_path: str | None = None,
+        context_index: bool = False,
+        sentence_index: bool = False,
+) -> FilterConfig:
+    """
+    Build an enabled `FilterConfig` from whitelist files and a context file, either a pickle file or a
+    `ContextStore` (`*.sqlite`)
+    """
+    config = FilterConfig(enabled=True)
+    for label_whitelist_path in label_whitelist_paths or []:
+        config.label_whitelist.update(csc.load_file(label_whitelist_path))
+    for predict_whitelist_path in predict_whitelist_paths or []:
+        config.predict_whitelist.update(csc.load_file(predict_whitelist_path))
+    if context_path:
+        sentence_index_path = pathlib.Path(f'{context_path}.sentences')
+        sentence_index_fresh = sentence_index and csc.context.SentenceIndex.is_fresh(sentence_index_path, context_path)
+        if pathlib.Path(context_path).suffix == '.sqlite':
+            config = dataclasses.replace(config, context_store=csc.context.ContextStore(context_path))
+        elif sentence_index_fresh:
+            # The queries are the second object of the file, only the contexts are needed
+            with open(context_path, 'rb') as file:
+                config.context_dict = pickle.load(file)
+        else:
+            config.context_dict, config.query_dict = csc.load_file(context_path)
+        if context_index:
+            context_index_path = pathlib.Path(f'{context_path}.index')
+            if not csc.context.ContextIndex.is_fresh(context_index_path, context_path):
+                csc.context.ContextIndex.build(config.context_dict, context_index_path)
+            config.context_dict = csc.context.ContextIndex(context_index_path)
+        if sentence_index:
+            if not sentence_index_fresh:
+                csc.context.SentenceIndex.build(config.query_dict, config.context_dict, sentence_index_path)
+            config.query_dict = csc.context.SentenceIndex(sentence_index_path, config.context_dict)
+    return config
+
+
+@dataclasses.dataclass
+class BootstrapConfig:
+    enabled: bool = False
+    n_resamples: int = 1000
+    confidence: float = 0.95
+    seed: int = 0
+    # Report directory (or counts file) of a previous run over the same data, compared with a paired bootstrap
+    baseline_path: str | pathlib.Path | None = None
 
 
 @dataclasses.dataclass
@@ -47,9 +112,13 @@ class EvaluationConfig:
     json_report: JSONReportConfig = dataclasses.field(default_factory=JSONReportConfig)
     extract_output: ExtractionConfig = dataclasses.field(default_factory=ExtractionConfig)
     filter_output: FilterConfig = dataclasses.field(default_factory=FilterConfig)
+    bootstrap: BootstrapConfig = dataclasses.field(default_factory=BootstrapConfig)
+    cache_path: str | pathlib.Path | None = None
 
     def __post_init__(self):
         self.report_path = pathlib.Path(self.report_path)
+        if self.cache_path is not None:
+            self.cache_path = pathlib.Path(self.cache_path)
 
 
 @dataclasses.dataclass
@@ -60,6 +129,13 @@ class EvaluationResult:
         precision: float | None = None
         f1: float | None = None
 
+        @classmethod
+        def from_counts(cls, tp: int, fp: int, fn: int) -> 'EvaluationResult.Metric':
+            precision = tp / (tp + fp + 1e-8)
+            recall = tp / (tp + fn + 1e-8)
+            f1 = 2 * precision * recall / (precision + recall + 1e-8)
+            return cls(recall=recall, precision=precision, f1=f1)
+
     @dataclasses.dataclass
     class Statistic:
         @dataclasses.dataclass
@@ -72,9 +148,163 @@ class EvaluationResult:
         label: InnerStatistic = dataclasses.field(default_factory=InnerStatistic)
         predict: InnerStatistic = dataclasses.field(default_factory=InnerStatistic)
 
+    @dataclasses.dataclass
+    class Bootstrap:
+        @dataclasses.dataclass
+        class Interval:
+            low: float | None = None
+            high: float | None = None
+
+        n_resamples: int | None = None
+        confidence: float | None = None
+        recall: Interval = dataclasses.field(default_factory=Interval)
+        precision: Interval = dataclasses.field(default_factory=Interval)
+        f1: Interval = dataclasses.field(default_factory=Interval)
+
+    @dataclasses.dataclass
+    class PairedBootstrap:
+        @dataclasses.dataclass
+        class Difference:
+            difference: float | None = None
+            low: float | None = None
+            high: float | None = None
+            p_value: float | None = None
+
+        baseline: str | None = None
+        n_resamples: int | None = None
+        confidence: float | None = None
+        recall: Difference = dataclasses.field(default_factory=Difference)
+        precision: Difference = dataclasses.field(default_factory=Difference)
+        f1: Difference = dataclasses.field(default_factory=Difference)
+
+    @dataclasses.dataclass
+    class Cache:
+        n_hits: int | None = None
+        n_misses: int | None = None
+
     metrics: Metric = dataclasses.field(default_factory=Metric)
     char_statistics: Statistic = dataclasses.field(default_factory=Statistic)
     sample_statistics: Statistic = dataclasses.field(default_factory=Statistic)
+    bootstrap: Bootstrap | None = None
+    paired_bootstrap: PairedBootstrap | None = None
+    cache: Cache | None = None
+
+
+def to_code_points(string: str) -> np.ndarray:
+    return np.frombuffer(string.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+
+
+def find_all(codes: np.ndarray, pattern: np.ndarray) -> np.ndarray:
+    """Mark every position of `codes` where `pattern` starts"""
+    found = np.zeros(len(codes), dtype=bool)
+    n = len(codes) - len(pattern) + 1
+    if n > 0:
+        found[:n] = True
+        for i, code in enumerate(pattern):
+            found[:n] &= codes[i:i + n] == code
+    return found
+
+
+def segment_sum(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Number of `True` values in every packed segment, `offsets` being the segment boundaries"""
+    owners = np.searchsorted(offsets, np.flatnonzero(values), side='right') - 1
+    return np.bincount(owners, minlength=len(offsets) - 1).astype(np.int64)
+
+
+def gather_segments(
+        values: np.ndarray,
+        offsets: np.ndarray,
+        take_lengths: np.ndarray,
+        out_lengths: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Build packed segments of `out_lengths`, each starting with the first `take_lengths` values of the corresponding
+    input segment and padded with `False`.
+    """
+    if np.array_equal(take_lengths, out_lengths) and np.array_equal(take_lengths, np.diff(offsets)):
+        return values, offsets
+    out_offsets = np.zeros(len(out_lengths) + 1, dtype=np.int64)
+    np.cumsum(out_lengths, out=out_offsets[1:])
+    out = np.zeros(out_offsets[-1], dtype=bool)
+    segments = np.repeat(np.arange(len(take_lengths)), take_lengths)
+    within = np.arange(len(segments)) - np.repeat(np.cumsum(take_lengths) - take_lengths, take_lengths)
+    out[out_offsets[:-1][segments] + within] = values[offsets[:-1][segments] + within]
+    return out, out_offsets
+
+
+@dataclasses.dataclass
+class BatchScore:
+    """
+    Scores of a batch of items, with the label/predict masks of all items packed into flat arrays
+    (the masks of item `i` are `masks[offsets[i]:offsets[i + 1]]`)
+    """
+    tp: np.ndarray
+    fp: np.ndarray
+    fn: np.ndarray
+    label_masks: np.ndarray
+    label_offsets: np.ndarray
+    predict_masks: np.ndarray
+    predict_offsets: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.tp)
+
+    @property
+    def label_errors(self) -> np.ndarray:
+        return segment_sum(self.label_masks, self.label_offsets)
+
+    @property
+    def predict_errors(self) -> np.ndarray:
+        return segment_sum(self.predict_masks, self.predict_offsets)
+
+    def label_array(self, i: int) -> list[bool]:
+        return self.label_masks[self.label_offsets[i]:self.label_offsets[i + 1]].tolist()
+
+    def predict_array(self, i: int) -> list[bool]:
+        return self.predict_masks[self.predict_offsets[i]:self.predict_offsets[i + 1]].tolist()
+
+    @classmethod
+    def pack(cls, scores: list[tuple[int, int, int, list[bool], list[bool]]]) -> 'BatchScore':
+        def _pack(arrays: list[list[bool]]) -> tuple[np.ndarray, np.ndarray]:
+            offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+            np.cumsum([len(array) for array in arrays], out=offsets[1:])
+            masks = np.fromiter((value for array in arrays for value in array), dtype=bool, count=offsets[-1])
+            return masks, offsets
+
+        label_masks, label_offsets = _pack([score[3] for score in scores])
+        predict_masks, predict_offsets = _pack([score[4] for score in scores])
+        return cls(
+            tp=np.array([score[0] for score in scores], dtype=np.int64),
+            fp=np.array([score[1] for score in scores], dtype=np.int64),
+            fn=np.array([score[2] for score in scores], dtype=np.int64),
+            label_masks=label_masks,
+            label_offsets=label_offsets,
+            predict_masks=predict_masks,
+            predict_offsets=predict_offsets,
+        )
+
+
+@dataclasses.dataclass
+class ParsedItem:
+    """
+    An item parsed once by its template and shared by the evaluation and every report.
+    `label_mask`/`predict_mask` mark the tagged characters of `label_text`/`predict_text`, which are the label and
+    the prediction without tags. The reasoning is kept as a span of the raw prediction.
+    """
+    item: dict | None
+    prompt: str
+    label: str
+    predict: str
+    label_mask: list[bool]
+    label_text: str
+    predict_mask: list[bool]
+    predict_text: str
+    reasoning_span: tuple[int, int] = (0, 0)
+
+    @property
+    def reasoning(self) -> str:
+        start, end = self.reasoning_span
+        return self.item['predict'][start:end]
 
 
 class Template(abc.ABC):
@@ -84,6 +314,10 @@ class Template(abc.ABC):
     def eval_one(cls, label: str, predict: str) -> tuple[int, int, int, list[bool], list[bool]]:
         raise NotImplementedError
 
+    @classmethod
+    def eval_batch(cls, labels: list[str], predicts: list[str]) -> BatchScore:
+        return BatchScore.pack([cls.eval_one(label, predict) for label, predict in zip(labels, predicts)])
+
     @classmethod
     def clean_prompt(cls, prompt: str) -> str:
         return prompt
@@ -96,16 +330,69 @@ class Template(abc.ABC):
     def clean_predict(cls, predict: str) -> str:
         return predict
 
+    @classmethod
+    def item_prompt(cls, item: dict) -> str:
+        """The sentence of an item, from the `input` of its dataset record when inference wrote it"""
+        if item.get('input') is not None:
+            return item['input']
+        return cls.clean_prompt(item['prompt'])
+
+    @classmethod
+    def item_label(cls, item: dict) -> str:
+        """The label of an item, from the `output` of its dataset record when inference wrote it"""
+        if item.get('output') is not None:
+            return item['output']
+        return cls.clean_label(item['label'])
+
     @classmethod
     def clean_reasoning(cls, predict: str) -> str:
         return ''
 
+    @classmethod
+    def reasoning_span(cls, predict: str) -> tuple[int, int]:
+        """Span of `clean_reasoning(predict)` in `predict`"""
+        return 0, 0
+
+    @classmethod
+    def strip_tags(cls, text: str) -> tuple[list[bool], str]:
+        return [False] * len(text), text
+
+    @classmethod
+    def parse(cls, item: dict) -> ParsedItem:
+        label = cls.item_label(item)
+        predict = cls.clean_predict(item['predict'])
+        label_mask, label_text = cls.strip_tags(label)
+        predict_mask, predict_text = cls.strip_tags(predict)
+        return ParsedItem(
+            item=item,
+            prompt=cls.item_prompt(item),
+            label=label,
+            predict=predict,
+            label_mask=label_mask,
+            label_text=label_text,
+            predict_mask=predict_mask,
+            predict_text=predict_text,
+            reasoning_span=cls.reasoning_span(item['predict']),
+        )
+
     @classmethod
     def filter_text(cls, text: str, whitelist: set[str], context: str = '') -> str:
         for char in whitelist:
             text = text.replace(char, '')
         return text
 
+    @classmethod
+    def filter_marked(
+            cls,
+            text_array: list[bool],
+            text_without_tags: str,
+            whitelist: set[str],
+            context: str = '',
+            params: dict | None = None,
+    ) -> str:
+        """`filter_text` on a text already split by `strip_tags` into its error marks and its characters without tags"""
+        return cls.filter_text(text_without_tags, whitelist, context)
+
 
 class Template0(Template):
     """
@@ -114,12 +401,16 @@ class Template0(Template):
     opening_tag = '<csc>'
     closing_tag = '</csc>'
 
+    @classmethod
+    @functools.cache
+    def error_pattern(cls) -> re.Pattern:
+        return re.compile(rf'{cls.opening_tag}(.?){cls.closing_tag}')
+
     @classmethod
     def mark_errors(cls, string) -> list[bool]:
         is_error = []
-        pattern = re.compile(rf'{cls.opening_tag}(.?){cls.closing_tag}')
         current_index = 0
-        for match in pattern.finditer(string):
+        for match in cls.error_pattern().finditer(string):
             start, end = match.span()
             while current_index < start:
                 is_error.append(False)
@@ -131,6 +422,10 @@ class Template0(Template):
             current_index += 1
         return is_error
 
+    @classmethod
+    def strip_tags(cls, text: str) -> tuple[list[bool], str]:
+        return cls.mark_errors(text), text.replace(cls.opening_tag, '').replace(cls.closing_tag, '')
+
     @classmethod
     def clean_prompt(cls, prompt: str) -> str:
         return prompt.split('user\n')[-1].split('<|im_end|>\n<|im_start|>assistant\n')[0].split('\nassistant\n')[0]
@@ -161,16 +456,111 @@ class Template0(Template):
                 fn += 1
         return tp, fp, fn, label_array, predict_array
 
+    @classmethod
+    def _pack_errors(cls, strings: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        """Packed `mark_errors` of all strings, finding the tags with array operations over the joined strings"""
+        # Tags cannot span a newline, so joining with one keeps the matches of every string separate
+        codes = to_code_points('\n'.join(strings))
+        opening, closing = to_code_points(cls.opening_tag), to_code_points(cls.closing_tag)
+        is_opening, is_closing = find_all(codes, opening), find_all(codes, closing)
+        # `<tag>(.?)</tag>`: the empty form is tried only when the tag does not wrap a single character
+        content = len(opening)
+        wraps_char = np.zeros(len(codes), dtype=bool)
+        wraps_char[:-content - 1 or None] = is_closing[content + 1:] & (codes[content:-1] != ord('\n'))
+        wraps_empty = np.zeros(len(codes), dtype=bool)
+        wraps_empty[:-content or None] = is_closing[content:]
+        wraps_char &= is_opening
+        wraps_empty &= is_opening & ~wraps_char
+        starts = np.flatnonzero(wraps_char | wraps_empty)
+        shrinks = len(opening) + len(closing) - 1 + wraps_char[starts]
+
+        string_lengths = np.fromiter(map(len, strings), dtype=np.int64, count=len(strings))
+        string_starts = np.cumsum(string_lengths + 1) - string_lengths - 1
+        owners = np.searchsorted(string_starts, starts, side='right') - 1
+        shrink_before = np.cumsum(shrinks) - shrinks
+        shrink_totals = np.bincount(owners, weights=shrinks, minlength=len(strings)).astype(np.int64)
+        shrink_starts = np.cumsum(shrink_totals) - shrink_totals
+        offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+        np.cumsum(string_lengths - shrink_totals, out=offsets[1:])
+        masks = np.zeros(offsets[-1], dtype=bool)
+        positions = starts - string_starts[owners] - (shrink_before - shrink_starts[owners])
+        masks[offsets[:-1][owners] + positions] = True
+        return masks, offsets
+
+    @classmethod
+    def eval_batch(cls, labels: list[str], predicts: list[str]) -> BatchScore:
+        """Vectorized `eval_one` over a batch of items, including its length mismatch rules"""
+        label_masks, label_offsets = cls._pack_errors(labels)
+        predict_masks, predict_offsets = cls._pack_errors(predicts)
+        label_lengths, predict_lengths = np.diff(label_offsets), np.diff(predict_offsets)
+        no_label = np.array([label == '' for label in labels], dtype=bool)
+        difference = label_lengths - predict_lengths
+        give_up = ~no_label & (np.abs(difference) > 1)
+        # Items differing by one character (usually a trailing punctuation mark) are compared on the common length
+        common_lengths = np.minimum(label_lengths, predict_lengths)
+        label_out_lengths = np.where(no_label, 0, np.where(give_up, label_lengths, common_lengths))
+        predict_out_lengths = np.where(no_label, predict_lengths, label_out_lengths)
+        predict_take_lengths = np.where(give_up, 0, predict_out_lengths)
+        label_masks, label_offsets = gather_segments(label_masks, label_offsets, label_out_lengths, label_out_lengths)
+        predict_masks, predict_offsets = gather_segments(
+            predict_masks,
+            predict_offsets,
+            predict_take_lengths,
+            predict_out_lengths,
+        )
+        # Items without labels have no label mask to compare with, every prediction is counted as a true positive
+        paired_predict_masks, _ = gather_segments(predict_masks, predict_offsets, label_out_lengths, label_out_lengths)
+        tp = segment_sum(label_masks & paired_predict_masks, label_offsets)
+        fp = segment_sum(~label_masks & paired_predict_masks, label_offsets)
+        fn = segment_sum(label_masks & ~paired_predict_masks, label_offsets)
+        tp = np.where(no_label, segment_sum(predict_masks, predict_offsets), tp)
+        return BatchScore(
+            tp=tp,
+            fp=fp,
+            fn=fn,
+            label_masks=label_masks,
+            label_offsets=label_offsets,
+            predict_masks=predict_masks,
+            predict_offsets=predict_offsets,
+        )
+
     @classmethod
     def filter_text(cls, text: str, whitelist: set[str], context: str = '', params: dict | None = None) -> str:
+        return cls.filter_marked(*cls.strip_tags(text), whitelist, context, params)
+
+    @classmethod
+    def filter_marked(
+            cls,
+            text_array: list[bool],
+            text_without_tags: str,
+            whitelist: set[str],
+            context: str = '',
+            params: dict | None = None,
+    ) -> str:
+        """`filter_text` on a text already split into its error marks and its characters without tags"""
         if not params:
             params = {}
-        text_array = cls.mark_errors(text)
-        text_without_tags = text.replace(cls.opening_tag, '').replace(cls.closing_tag, '')
-        for i in range(len(text_array)):
-            if text_array[i]:
-                if cls._is_whitelisted(i, text_without_tags, whitelist, context, params):
+        text_array = list(text_array)
+        matcher = params.get('whitelist_matcher')
+        if matcher is not None and any(text_array):
+            # The precompiled matcher finds every whitelisted position in one scan of the text
+            covered = matcher.covered(text_without_tags)
+            for i in range(len(text_array)):
+                if not text_array[i]:
+                    continue
+                if i < len(covered) and covered[i]:
                     text_array[i] = False
+                elif cls._is_frequent_in_context(i, text_without_tags, context, params):
+                    text_array[i] = False
+        else:
+            for i in range(len(text_array)):
+                if text_array[i]:
+                    if cls._is_whitelisted(i, text_without_tags, whitelist, context, params):
+                        text_array[i] = False
+        return cls.render_marked(text_array, text_without_tags)
+
+    @classmethod
+    def render_marked(cls, text_array: list[bool], text_without_tags: str) -> str:
         text = ''
         for should_mark, char in zip(text_array, text_without_tags):
             if should_mark:
@@ -189,6 +579,10 @@ class Template0(Template):
                 substr = text[l_offset:r_offset]
                 if substr in whitelist:
                     return True
+        return cls._is_frequent_in_context(position, text, context, params)
+
+    @classmethod
+    def _is_frequent_in_context(cls, position: int, text: str, context: str, params: dict) -> bool:
         context_compare_length = params.get('context_compare_length', 2)
         context_threshold = params.get('context_threshold', 1)
         for l_offset in range(position - (context_compare_length - 1), position + 1):
@@ -218,9 +612,8 @@ class Template1(Template0):
 
     @classmethod
     def clean_predict(cls, predict: str) -> str:
-        if '\n</think>\n\n' not in predict:
-            return ''
-        return predict.split('\n</think>\n\n')[-1]
+        _, separator, predict = predict.rpartition('\n</think>\n\n')
+        return predict if separator else ''
 
     @classmethod
     def clean_reasoning(cls, predict: str) -> str:
@@ -228,6 +621,15 @@ class Template1(Template0):
             return ''
         return predict.split('<think>\n')[-1].split('\n</think>\n\n')[0]
 
+    @classmethod
+    def reasoning_span(cls, predict: str) -> tuple[int, int]:
+        if '\n</think>\n\n' not in predict:
+            return 0, 0
+        start = predict.rfind('<think>\n')
+        start = 0 if start == -1 else start + len('<think>\n')
+        end = predict.find('\n</think>\n\n', start)
+        return start, len(predict) if end == -1 else end
+
 
 templates = [
     Template0,
@@ -243,91 +645,420 @@ def add(a, b):
     return a + b
 
 
+@dataclasses.dataclass
+class ItemResult:
+    tp: int
+    fp: int
+    fn: int
+    parsed: ParsedItem
+    correct: bool
+    label_array: list[bool]
+    predict_array: list[bool]
+
+    @property
+    def n_chars(self) -> int:
+        return len(self.parsed.prompt)
+
+
+@dataclasses.dataclass
+class PartialResult:
+    """
+    Counters of a contiguous run of items, which can be merged in order to get the counters of the whole input
+    """
+    tp: int = 0
+    fp: int = 0
+    fn: int = 0
+    has_label: bool = False
+    n_chars: int = 0
+    n_samples: int = 0
+    n_correct: int = 0
+    n_label_char_errors: int = 0
+    n_label_sample_errors: int = 0
+    n_predict_char_errors: int = 0
+    n_predict_sample_errors: int = 0
+
+    def update(self, result: ItemResult):
+        self.tp += result.tp
+        self.fp += result.fp
+        self.fn += result.fn
+        self.has_label |= len(result.label_array) > 0
+        self.n_chars += result.n_chars
+        self.n_samples += 1
+        self.n_correct += result.correct
+        n_label_errors, n_predict_errors = sum(result.label_array), sum(result.predict_array)
+        self.n_label_char_errors += n_label_errors
+        self.n_label_sample_errors += n_label_errors > 0
+        self.n_predict_char_errors += n_predict_errors
+        self.n_predict_sample_errors += n_predict_errors > 0
+
+    @classmethod
+    def from_batch(
+            cls,
+            score: BatchScore,
+            n_chars: typing.Sequence[int],
+            corrects: typing.Sequence[bool],
+    ) -> 'PartialResult':
+        label_errors, predict_errors = score.label_errors, score.predict_errors
+        return cls(
+            tp=int(score.tp.sum()),
+            fp=int(score.fp.sum()),
+            fn=int(score.fn.sum()),
+            has_label=bool(len(score.label_masks)),
+            n_chars=sum(n_chars),
+            n_samples=len(score),
+            n_correct=sum(corrects),
+            n_label_char_errors=int(label_errors.sum()),
+            n_label_sample_errors=int(np.count_nonzero(label_errors)),
+            n_predict_char_errors=int(predict_errors.sum()),
+            n_predict_sample_errors=int(np.count_nonzero(predict_errors)),
+        )
+
+    def merge(self, other: 'PartialResult'):
+        for field in dataclasses.fields(self):
+            if field.name == 'has_label':
+                self.has_label |= other.has_label
+            else:
+                setattr(self, field.name, getattr(self, field.name) + getattr(other, field.name))
+
+
+def hash_strings(strings: typing.Iterable[str], seed: bytes = b'') -> bytes:
+    hasher = hashlib.blake2b(seed, digest_size=16)
+    for string in strings:
+        data = string.encode('utf-8', 'surrogatepass')
+        hasher.update(len(data).to_bytes(8, 'little'))
+        hasher.update(data)
+    return hasher.digest()
+
+
+class ItemEvaluator:
+    """
+    Evaluates single items with a given template and filter configuration.
+    It holds no report state, so that it can be replicated in worker processes.
+    """
+
+    def __init__(self, template: type[Template], filter_config: FilterConfig):
+        self.template = template
+        self.filter_config = filter_config
+        self.predict_whitelist_matcher = None
+        self._context_hashes = {}
+        if filter_config.enabled:
+            compare_range = set(filter_config.whitelist_compare_range)
+            self.predict_whitelist_matcher = csc.matcher.AhoCorasick(
+                word for word in filter_config.predict_whitelist if len(word) in compare_range
+            )
+
+    def get_context(self, prompt: str) -> tuple[int | None, str]:
+        context_id = self.filter_config.query_dict.get(prompt)
+        if context_id:
+            return context_id, self.filter_config.context_dict.get(context_id, '')
+        return context_id, ''
+
+    @functools.cached_property
+    def fingerprint(self) -> bytes:
+        """Hash of everything besides the item itself that the result of an item depends on"""
+        config = self.filter_config
+        settings = [self.template.__module__, self.template.__qualname__, config.enabled]
+        if config.enabled:
+            settings += [
+                hash_strings(sorted(config.label_whitelist)).hex(),
+                hash_strings(sorted(config.predict_whitelist)).hex(),
+                config.context_threshold,
+                config.context_compare_length,
+                list(config.whitelist_compare_range),
+            ]
+        return hash_strings([json.dumps(settings)])
+
+    def cache_key(self, item: dict) -> bytes:
+        parts = [item['prompt'], item['label'], item['predict']]
+        if self.filter_config.enabled:
+            context_id, context = self.get_context(self.template.item_prompt(item))
+            if context_id not in self._context_hashes:
+                self._context_hashes[context_id] = hash_strings([str(context)]).hex()
+            parts.append(self._context_hashes[context_id])
+        return hash_strings(parts, self.fingerprint)
+
+    def prepare(self, item: dict) -> tuple[ParsedItem, str, str, bool]:
+        """
+        Parse and filter an item, returning the parsed item, the filtered label and prediction,
+        and whether it was predicted correctly
+        """
+        parsed = self.template.parse(item)
+        label, predict = parsed.label, parsed.predict
+        correct = label == predict
+        if self.filter_config.enabled:
+            _, context = self.get_context(parsed.prompt)
+            label = self.template.filter_marked(
+                parsed.label_mask,
+                parsed.label_text,
+                self.filter_config.label_whitelist,
+            )
+            predict = self.template.filter_marked(
+                parsed.predict_mask,
+                parsed.predict_text,
+                self.filter_config.predict_whitelist,
+                context,
+                {
+                    'whitelist_compare_range': self.filter_config.whitelist_compare_range,
+                    'whitelist_matcher': self.predict_whitelist_matcher,
+                    'context_compare_length': self.filter_config.context_compare_length,
+                    'context_threshold': self.filter_config.context_threshold,
+                },
+            )
+        return parsed, label, predict, correct
+
+    def eval(self, item: dict) -> ItemResult:
+        parsed, label, predict, correct = self.prepare(item)
+        tp, fp, fn, label_array, predict_array = self.template.eval_one(label, predict)
+        return ItemResult(
+            tp=tp,
+            fp=fp,
+            fn=fn,
+            parsed=parsed,
+            correct=correct,
+            label_array=label_array,
+            predict_array=predict_array,
+        )
+
+    def eval_shard(self, items: list[dict]) -> tuple[list[ItemResult], PartialResult]:
+        prepared = [self.prepare(item) for item in items]
+        labels = [label for _, label, _, _ in prepared]
+        predicts = [predict for _, _, predict, _ in prepared]
+        score = self.template.eval_batch(labels, predicts)
+        results = [
+            ItemResult(
+                tp=int(score.tp[i]),
+                fp=int(score.fp[i]),
+                fn=int(score.fn[i]),
+                parsed=parsed,
+                correct=correct,
+                label_array=score.label_array(i),
+                predict_array=score.predict_array(i),
+            )
+            for i, (parsed, _, _, correct) in enumerate(prepared)
+        ]
+        n_chars = [result.n_chars for result in results]
+        corrects = [result.correct for result in results]
+        return results, PartialResult.from_batch(score, n_chars, corrects)
+
+
+class ItemCache:
+    """
+    Results of items evaluated in previous runs, keyed by the content of the item and the effective filter
+    configuration (see `ItemEvaluator.cache_key`), so that only new or affected items are evaluated again
+    """
+
+    def __init__(self, path: str | pathlib.Path, evaluator: ItemEvaluator):
+        self.store = csc.cache.SQLiteCache(path, table='items')
+        self.evaluator = evaluator
+        self.n_hits = 0
+        self.n_misses = 0
+
+    def lookup(self, items: list[dict]) -> tuple[list[bytes], dict[int, ItemResult]]:
+        keys = [self.evaluator.cache_key(item) for item in items]
+        found = self.store.get_many(keys)
+        hits = {}
+        for i, (item, key) in enumerate(zip(items, keys)):
+            if key in found:
+                hits[i] = self.decode(item, found[key])
+        self.n_hits += len(hits)
+        self.n_misses += len(items) - len(hits)
+        return keys, hits
+
+    def update(self, keys: list[bytes], results: dict[int, ItemResult]):
+        self.store.put_many((keys[i], self.encode(result)) for i, result in results.items())
+
+    @staticmethod
+    def encode(result: ItemResult) -> bytes:
+        return pickle.dumps((
+            result.tp,
+            result.fp,
+            result.fn,
+            result.correct,
+            bytes(result.label_array),
+            bytes(result.predict_array),
+        ))
+
+    def decode(self, item: dict, value: bytes) -> ItemResult:
+        tp, fp, fn, correct, label_array, predict_array = pickle.loads(value)
+        return ItemResult(
+            tp=tp,
+            fp=fp,
+            fn=fn,
+            parsed=self.evaluator.template.parse(item),
+            correct=correct,
+            label_array=[bool(value) for value in label_array],
+            predict_array=[bool(value) for value in predict_array],
+        )
+
+    def close(self):
+        self.store.close()
+
+
+_worker_evaluator: ItemEvaluator | None = None
+
+
+def _init_worker(evaluator: ItemEvaluator):
+    global _worker_evaluator
+    _worker_evaluator = evaluator
+
+
+def _eval_shard_in_worker(items: list[dict]) -> tuple[list[ItemResult], PartialResult]:
+    results, partial = _worker_evaluator.eval_shard(items)
+    # The parent process still holds the raw items, do not send them back
+    for result in results:
+        result.parsed.item = None
+    return results, partial
+
+
+def iter_shards(data: typing.Iterable[dict], shard_size: int) -> typing.Iterator[list[dict]]:
+    shard = []
+    for item in data:
+        shard.append(item)
+        if len(shard) == shard_size:
+            yield shard
+            shard = []
+    if shard:
+        yield shard
+
+
 class Metric:
 
-    def __init__(self, config: EvaluationConfig, template: int):
+    def __init__(self, config: EvaluationConfig, template: int, workers: int = 1, shard_size: int = 256):
         self.config = config
         self.template = templates[template]
+        self.workers = workers
+        self.shard_size = shard_size
         self.result = EvaluationResult()
         self.reports = csc.report.ReportManager(self.config)
 
-    def eval(self, data: list[dict]) -> EvaluationResult:
+    def _eval_shards(
+            self,
+            data: typing.Iterable[dict],
+    ) -> typing.Iterator[tuple[list[dict], list[ItemResult], PartialResult]]:
+        evaluator = ItemEvaluator(self.template, self.config.filter_output)
+        shards = iter_shards(data, self.shard_size)
+        if self.config.cache_path is None:
+            for shard, _, _, results, partial in self._eval_jobs(evaluator, ((shard, [], {}) for shard in shards)):
+                yield shard, results, partial
+            return
+        cache = ItemCache(self.config.cache_path, evaluator)
+        try:
+            for shard, keys, hits, results, partial in self._eval_jobs(
+                    evaluator,
+                    ((shard, *cache.lookup(shard)) for shard in shards),
+            ):
+                cache.update(keys, {i: result for i, result in enumerate(results) if i not in hits})
+                yield shard, results, partial
+        finally:
+            self.result.cache = EvaluationResult.Cache(n_hits=cache.n_hits, n_misses=cache.n_misses)
+            cache.close()
+
+    def _eval_jobs(
+            self,
+            evaluator: ItemEvaluator,
+            jobs: typing.Iterable[tuple[list[dict], list[bytes], dict[int, ItemResult]]],
+    ) -> typing.Iterator[tuple]:
+        """
+        Evaluate the items of every shard which are not already known from the cache (`hits`),
+        yielding the shard with the results of all its items in order
+        """
+        if self.workers <= 1:
+            for shard, keys, hits in jobs:
+                misses = [item for i, item in enumerate(shard) if i not in hits]
+                yield self._join_results(shard, keys, hits, *evaluator.eval_shard(misses))
+            return
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(evaluator,),
+        ) as executor:
+            # Keep a bounded number of shards in flight, so that memory does not grow with the input size
+            pending = collections.deque()
+            for shard, keys, hits in jobs:
+                misses = [item for i, item in enumerate(shard) if i not in hits]
+                pending.append((shard, keys, hits, misses, executor.submit(_eval_shard_in_worker, misses)))
+                if len(pending) >= self.workers * 4:
+                    yield self._join_future(*pending.popleft())
+            while pending:
+                yield self._join_future(*pending.popleft())
+
+    def _join_future(
+            self,
+            shard: list[dict],
+            keys: list[bytes],
+            hits: dict[int, ItemResult],
+            misses: list[dict],
+            future: concurrent.futures.Future,
+    ) -> tuple:
+        results, partial = future.result()
+        for item, result in zip(misses, results):
+            result.parsed.item = item
+        return self._join_results(shard, keys, hits, results, partial)
+
+    @staticmethod
+    def _join_results(
+            shard: list[dict],
+            keys: list[bytes],
+            hits: dict[int, ItemResult],
+            results: list[ItemResult],
+            partial: PartialResult,
+    ) -> tuple:
+        if not hits:
+            return shard, keys, hits, results, partial
+        evaluated = iter(results)
+        results = [hits[i] if i in hits else next(evaluated) for i in range(len(shard))]
+        for result in hits.values():
+            partial.update(result)
+        return shard, keys, hits, results, partial
+
+    def eval(self, data: typing.Iterable[dict]) -> EvaluationResult:
         if not self.reports.init():
             return self.result
         self.reports.write_head()
 
-        total_tp, total_fp, total_fn = 0, 0, 0
-        self.result.char_statistics.n_total = 0
-        self.result.sample_statistics.n_total = 0
-        self.result.sample_statistics.n_correct = 0
-        has_label = False
-        for item in data:
-            prompt = self.template.clean_prompt(item['prompt'])
-            label = self.template.clean_label(item['label'])
-            predict = self.template.clean_predict(item['predict'])
-            if label == predict:
-                self.result.sample_statistics.n_correct += 1
-            if self.config.filter_output.enabled:
-                context_id = self.config.filter_output.query_dict.get(prompt)
-                if context_id:
-                    context = self.config.filter_output.context_dict.get(context_id, '')
-                else:
-                    context = ''
-                label = self.template.filter_text(label, self.config.filter_output.label_whitelist)
-                predict = self.template.filter_text(
-                    predict,
-                    self.config.filter_output.predict_whitelist,
-                    context,
-                    {
-                        'whitelist_compare_range': self.config.filter_output.whitelist_compare_range,
-                        'context_compare_length': self.config.filter_output.context_compare_length,
-                        'context_threshold': self.config.filter_output.context_threshold,
-                    },
+        partial = PartialResult()
+        # Per-sample counts, kept for the bootstrap
+        indices, counts = [], []
+        for _, results, shard_partial in self._eval_shards(csc.expand_predictions(data)):
+            partial.merge(shard_partial)
+            if self.config.bootstrap.enabled:
+                indices.append(np.array([
+                    result.parsed.item.get('index', partial.n_samples - len(results) + i)
+                    for i, result in enumerate(results)
+                ], dtype=np.int64))
+                counts.append(np.array([(result.tp, result.fp, result.fn) for result in results], dtype=np.int64))
+            for result in results:
+                self.reports.write_entry(
+                    tp=result.tp,
+                    fp=result.fp,
+                    fn=result.fn,
+                    length=len(result.label_array),
+                    parsed=result.parsed,
+                    label_array=result.label_array,
+                    predict_array=result.predict_array,
                 )
-            self.result.char_statistics.n_total += len(prompt)
-            self.result.sample_statistics.n_total += 1
-
-            tp, fp, fn, label_array, predict_array = self.template.eval_one(label, predict)
-            total_tp += tp
-            total_fp += fp
-            total_fn += fn
-
-            has_label |= len(label_array)
-            self.result.char_statistics.label.n_error = add(
-                self.result.char_statistics.label.n_error,
-                sum(label_array),
-            )
-            self.result.sample_statistics.label.n_error = add(
-                self.result.sample_statistics.label.n_error,
-                sum(label_array) > 0,
-            )
-            self.result.char_statistics.predict.n_error = add(
-                self.result.char_statistics.predict.n_error,
-                sum(predict_array),
-            )
-            self.result.sample_statistics.predict.n_error = add(
-                self.result.sample_statistics.predict.n_error,
-                sum(predict_array) > 0,
-            )
 
-            self.reports.write_entry(
-                tp=tp,
-                fp=fp,
-                fn=fn,
-                length=len(label_array),
-                item=item,
-                template=self.template,
-                label_array=label_array,
-                predict_array=predict_array,
-            )
-
-        if has_label:
-            precision = total_tp / (total_tp + total_fp + 1e-8)
-            recall = total_tp / (total_tp + total_fn + 1e-8)
-            f1 = 2 * precision * recall / (precision + recall + 1e-8)
-            self.result.metrics.precision = precision
-            self.result.metrics.recall = recall
-            self.result.metrics.f1 = f1
+        self.result.char_statistics.n_total = partial.n_chars
+        self.result.sample_statistics.n_total = partial.n_samples
+        self.result.sample_statistics.n_correct = partial.n_correct
+        self.result.char_statistics.label.n_error = add(
+            self.result.char_statistics.label.n_error,
+            partial.n_label_char_errors,
+        )
+        self.result.sample_statistics.label.n_error = add(
+            self.result.sample_statistics.label.n_error,
+            partial.n_label_sample_errors,
+        )
+        self.result.char_statistics.predict.n_error = add(
+            self.result.char_statistics.predict.n_error,
+            partial.n_predict_char_errors,
+        )
+        self.result.sample_statistics.predict.n_error = add(
+            self.result.sample_statistics.predict.n_error,
+            partial.n_predict_sample_errors,
+        )
+        if partial.has_label:
+            self.result.metrics = EvaluationResult.Metric.from_counts(partial.tp, partial.fp, partial.fn)
             self.result.char_statistics.label.error_rate = (
                     self.result.char_statistics.label.n_error / self.result.char_statistics.n_total
             )
@@ -341,5 +1072,42 @@ class Metric:
                 self.result.sample_statistics.predict.n_error / self.result.sample_statistics.n_total
         )
 
+        if self.config.bootstrap.enabled:
+            self.bootstrap(
+                np.concatenate(indices) if indices else np.empty(0, dtype=np.int64),
+                np.concatenate(counts) if counts else np.empty((0, 3), dtype=np.int64),
+                partial.has_label,
+            )
+
         self.reports.write_tail(self.result)
         return self.result
+
+    def bootstrap(self, indices: np.ndarray, counts: np.ndarray, has_label: bool):
+        config = self.config.bootstrap
+        csc.bootstrap.save_counts(self.config.report_path / csc.bootstrap.SAMPLE_COUNTS_FILE, indices, counts)
+        if not has_label or not len(counts):
+            return
+        intervals = csc.bootstrap.bootstrap(counts, config.n_resamples, config.confidence, config.seed)
+        self.result.bootstrap = EvaluationResult.Bootstrap(
+            n_resamples=config.n_resamples,
+            confidence=config.confidence,
+            **{name: EvaluationResult.Bootstrap.Interval(*values) for name, values in intervals.items()},
+        )
+        if config.baseline_path is None:
+            return
+        baseline_indices, baseline_counts = csc.bootstrap.load_counts(config.baseline_path)
+        if not np.array_equal(indices, baseline_indices):
+            raise ValueError(f'The baseline {config.baseline_path} was not evaluated on the same samples')
+        differences = csc.bootstrap.paired_bootstrap(
+            counts,
+            baseline_counts,
+            config.n_resamples,
+            config.confidence,
+            config.seed,
+        )
+        self.result.paired_bootstrap = EvaluationResult.PairedBootstrap(
+            baseline=str(config.baseline_path),
+            n_resamples=config.n_resamples,
+            confidence=config.confidence,
+            **{name: EvaluationResult.PairedBootstrap.Difference(*values) for name, values in differences.items()},
+        )
@@ -0,0 +1,150 @@
+import os
+import re
+import json
+import mmap
+import array
+import bisect
+import struct
+import pathlib
+
+MAGIC = b'CSCIDX01'
+HEADER = struct.Struct('<8sQqQQ')
+INDEX_PATTERN = re.compile(rb'^\s*\{\s*"index"\s*:\s*(-?\d+)\s*[,}]')
+
+
+def _read_key(line: bytes) -> int | None:
+    if match := INDEX_PATTERN.match(line):
+        return int(match.group(1))
+    index = json.loads(line).get('index')
+    return index if isinstance(index, int) else None
+
+
+class JSONLIndex:
+    """
+    Random access to the records of a JSONL file through a sidecar offset index.
+
+    The sidecar (`<file>.idx`) stores the byte offset of every record and groups record positions by their `index`
+    field. It is built once and rebuilt automatically when the size or the mtime of the JSONL file changes.
+    Records are decoded from a memory-mapped view of the file only when they are requested.
+    """
+
+    def __init__(self, path: str | pathlib.Path, rebuild: bool = False):
+        self.path = pathlib.Path(path)
+        self.index_path = self.path.with_name(self.path.name + '.idx')
+        if rebuild or not self._is_fresh():
+            self.build()
+        self._load()
+
+    def _stat(self) -> tuple[int, int]:
+        stat = self.path.stat()
+        return stat.st_size, stat.st_mtime_ns
+
+    def _is_fresh(self) -> bool:
+        if not self.index_path.exists():
+            return False
+        with self.index_path.open('rb') as f:
+            header = f.read(HEADER.size)
+        if len(header) != HEADER.size:
+            return False
+        magic, size, mtime_ns, _, _ = HEADER.unpack(header)
+        return magic == MAGIC and (size, mtime_ns) == self._stat()
+
+    def build(self):
+        size, mtime_ns = self._stat()
+        offsets = array.array('q')
+        grouped = {}
+        offset = 0
+        with self.path.open('rb') as f:
+            for line in f:
+                if line.strip():
+                    key = _read_key(line)
+                    if key is not None:
+                        grouped.setdefault(key, array.array('q')).append(len(offsets))
+                    offsets.append(offset)
+                offset += len(line)
+        n_records = len(offsets)
+        offsets.append(offset)
+        keys = array.array('q', sorted(grouped))
+        key_starts = array.array('q', [0])
+        positions = array.array('q')
+        for key in keys:
+            positions.extend(grouped[key])
+            key_starts.append(len(positions))
+        tmp_path = self.index_path.with_name(self.index_path.name + '.tmp')
+        with tmp_path.open('wb') as f:
+            f.write(HEADER.pack(MAGIC, size, mtime_ns, n_records, len(keys)))
+            for values in (offsets, keys, key_starts, positions):
+                values.tofile(f)
+        os.replace(tmp_path, self.index_path)
+
+    def _load(self):
+        self._index_file = self.index_path.open('rb')
+        self._index_map = mmap.mmap(self._index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        _, _, _, self.n_records, n_keys = HEADER.unpack_from(self._index_map)
+        self._values = values = memoryview(self._index_map)[HEADER.size:].cast('q')
+        n_positions = len(values) - (self.n_records + 1) - n_keys - (n_keys + 1)
+        self._offsets = values[:self.n_records + 1]
+        self._keys = values[self.n_records + 1:self.n_records + 1 + n_keys]
+        self._key_starts = values[self.n_records + 1 + n_keys:self.n_records + 2 + 2 * n_keys]
+        self._positions = values[self.n_records + 2 + 2 * n_keys:self.n_records + 2 + 2 * n_keys + n_positions]
+        # Prediction files are written with consecutive indices, in which case lookups are plain arithmetic
+        self._dense = n_keys > 0 and self._keys[-1] - self._keys[0] == n_keys - 1
+        self._file = self.path.open('rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.n_records else None
+
+    def close(self):
+        for name in ('_offsets', '_keys', '_key_starts', '_positions', '_values'):
+            getattr(self, name).release()
+        self._index_map.close()
+        self._index_file.close()
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.n_records
+
+    def __getitem__(self, position: int) -> dict:
+        if position < 0:
+            position += self.n_records
+        if not 0 <= position < self.n_records:
+            raise IndexError(f'Record position out of range: {position}')
+        return json.loads(self._map[self._offsets[position]:self._offsets[position + 1]])
+
+    def __iter__(self):
+        for position in range(self.n_records):
+            yield self[position]
+
+    def __contains__(self, index: int) -> bool:
+        return self._find(index) is not None
+
+    def _find(self, index: int) -> int | None:
+        if not len(self._keys):
+            return None
+        if self._dense:
+            k = index - self._keys[0]
+            return k if 0 <= k < len(self._keys) else None
+        k = bisect.bisect_left(self._keys, index)
+        return k if k < len(self._keys) and self._keys[k] == index else None
+
+    def indices(self) -> list[int]:
+        return self._keys.tolist()
+
+    def positions(self, index: int) -> list[int]:
+        k = self._find(index)
+        if k is None:
+            return []
+        return self._positions[self._key_starts[k]:self._key_starts[k + 1]].tolist()
+
+    def get(self, index: int, default: list[dict] | None = None) -> list[dict] | None:
+        """Return every record (e.g. all `n` candidates of one sentence) whose `index` field equals `index`."""
+        positions = self.positions(index)
+        if not positions:
+            return default
+        return [self[position] for position in positions]
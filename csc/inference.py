@@ -0,0 +1,696 @@
+import os
+import abc
+import json
+import mmap
+import time
+import array
+import random
+import shutil
+import typing
+import hashlib
+import pathlib
+import itertools
+import collections
+import dataclasses
+
+import numpy as np
+
+import csc
+
+
+def iter_chunks(items: typing.Sequence, chunk_size: int) -> typing.Iterator[typing.Sequence]:
+    for start in range(0, len(items), chunk_size):
+        yield items[start:start + chunk_size]
+
+
+def plan_requests(
+        prompt_token_ids: typing.Sequence[typing.Sequence[int]],
+        indices: typing.Sequence[int],
+        deduplicate: bool = False,
+        sort: bool = False,
+        mergeable: typing.Sequence[bool] | None = None,
+        bucket_size: int | None = None,
+) -> list[list[int]]:
+    """
+    Group the sample `indices` into generation requests, each request being the list of the samples it answers.
+    With `deduplicate`, samples with identical prompts (and `mergeable`, e.g. without images) share one request.
+    With `bucket_size`, requests are ordered by buckets of `bucket_size` prompt tokens, so that the sequences
+    generated together have similar lengths.
+    With `sort`, requests are ordered by their prompt tokens (within their bucket), so that consecutive prompts share
+    the longest prefixes.
+    """
+    if not deduplicate:
+        requests = [[index] for index in indices]
+    else:
+        groups = {}
+        for index in indices:
+            key = tuple(prompt_token_ids[index]) if mergeable is None or mergeable[index] else index
+            groups.setdefault(key, []).append(index)
+        requests = list(groups.values())
+    if bucket_size or sort:
+        def key(request: list[int]) -> tuple:
+            token_ids = prompt_token_ids[request[0]]
+            return len(token_ids) // bucket_size if bucket_size else 0, token_ids if sort else ()
+
+        requests.sort(key=key)
+    return requests
+
+
+def common_prefix_length(a: typing.Sequence[int], b: typing.Sequence[int]) -> int:
+    n = min(len(a), len(b))
+    mismatches = np.flatnonzero(np.asarray(a[:n]) != np.asarray(b[:n]))
+    return int(mismatches[0]) if len(mismatches) else n
+
+
+def request_stats(
+        prompt_token_ids: typing.Sequence[typing.Sequence[int]],
+        requests: list[list[int]],
+        block_size: int = 16,
+) -> dict:
+    """
+    Prompt tokens saved by merging duplicates, and prompt tokens which the prefix cache of the engine can reuse.
+    The latter is estimated from the full blocks of tokens each request shares with the previous one.
+    """
+    n_prompt_tokens = sum(len(prompt_token_ids[index]) for request in requests for index in request)
+    n_request_tokens = sum(len(prompt_token_ids[request[0]]) for request in requests)
+    n_cached_tokens = 0
+    for previous, request in zip(requests, requests[1:]):
+        shared = common_prefix_length(prompt_token_ids[previous[0]], prompt_token_ids[request[0]])
+        n_cached_tokens += shared // block_size * block_size
+    n_samples = sum(map(len, requests))
+    return {
+        'n_samples': n_samples,
+        'n_requests': len(requests),
+        'duplicate_hit_rate': 1 - len(requests) / n_samples if n_samples else 0.0,
+        'n_prompt_tokens': n_prompt_tokens,
+        'n_deduplicated_tokens': n_prompt_tokens - n_request_tokens,
+        'n_prefix_cached_tokens': n_cached_tokens,
+        'prefix_hit_rate': n_cached_tokens / n_request_tokens if n_request_tokens else 0.0,
+        'n_computed_tokens': n_request_tokens - n_cached_tokens,
+    }
+
+
+def candidates_disagree(template: type[csc.evaluation.Template0], predicts: typing.Iterable[str]) -> bool:
+    """Whether the candidates of a sentence mark different characters as errors"""
+    return len({tuple(template.mark_errors(template.clean_predict(predict))) for predict in predicts}) > 1
+
+
+def sample_adaptively(
+        generate: typing.Callable[[list[int], int, int], list[list]],
+        n_requests: int,
+        n_initial: int,
+        n_max: int,
+        disagree: typing.Callable[[list], bool],
+) -> list[list]:
+    """
+    Generate `n_initial` candidates for every request, then more candidates only for the requests whose candidates
+    `disagree`, doubling their number every round up to `n_max`.
+    `generate(positions, n, round)` returns the `n` new candidates of each of the requests at `positions`.
+    """
+    if not 2 <= n_initial <= n_max:
+        # A single candidate never disagrees with itself, so no request would get more candidates
+        raise ValueError(f'The initial number of candidates must be between 2 and {n_max}, got {n_initial}')
+    outputs = [[] for _ in range(n_requests)]
+    active = list(range(n_requests))
+    n_next = min(n_initial, n_max)
+    round_ = 0
+    while active and n_next > 0:
+        for position, candidates in zip(active, generate(active, n_next, round_)):
+            outputs[position].extend(candidates)
+        round_ += 1
+        # All the active requests have the same number of candidates
+        n_generated = len(outputs[active[0]])
+        n_next = min(n_generated, n_max - n_generated)
+        active = [position for position in active if disagree(outputs[position])]
+    return outputs
+
+
+def length_efficiency(
+        prompt_token_ids: typing.Sequence[typing.Sequence[int]],
+        requests: list[list[int]],
+        batch_size: int = 256,
+) -> float:
+    """
+    Share of useful tokens when the requests are generated `batch_size` at a time and every batch runs as long as its
+    longest prompt, 1 meaning that the requests of every batch have the same length
+    """
+    lengths = np.array([len(prompt_token_ids[request[0]]) for request in requests])
+    n_tokens, n_slots = 0, 0
+    for start in range(0, len(lengths), batch_size):
+        batch = lengths[start:start + batch_size]
+        n_tokens += int(batch.sum())
+        n_slots += int(batch.max()) * len(batch)
+    return n_tokens / n_slots if n_slots else 1.0
+
+
+class ThroughputMeter:
+    """Requests and tokens generated per second, measured chunk by chunk"""
+
+    def __init__(self):
+        self.n_requests = 0
+        self.n_prompt_tokens = 0
+        self.n_generated_tokens = 0
+        self.seconds = 0.0
+        self._start = None
+
+    def start(self):
+        self._start = time.perf_counter()
+
+    def stop(self, n_requests: int, n_prompt_tokens: int, n_generated_tokens: int):
+        self.seconds += time.perf_counter() - self._start
+        self.n_requests += n_requests
+        self.n_prompt_tokens += n_prompt_tokens
+        self.n_generated_tokens += n_generated_tokens
+
+    def report(self) -> dict:
+        seconds = self.seconds or float('nan')
+        return {
+            'n_requests': self.n_requests,
+            'n_prompt_tokens': self.n_prompt_tokens,
+            'n_generated_tokens': self.n_generated_tokens,
+            'seconds': self.seconds,
+            'requests_per_second': self.n_requests / seconds,
+            'prompt_tokens_per_second': self.n_prompt_tokens / seconds,
+            'generated_tokens_per_second': self.n_generated_tokens / seconds,
+        }
+
+
+class PredictionWriter:
+    """
+    Appends the predictions of an inference run chunk by chunk.
+
+    Every chunk is flushed and synced to disk before the manifest (`<file>.manifest.json`) records the size of the
+    file, so that a resumed run drops whatever an interrupted chunk left behind and skips the indices before it.
+    Once every sample is written, `finalize` puts the records in index order, and the manifest records it.
+    """
+
+    def __init__(self, path: str | pathlib.Path, n_samples: int, resume: bool = False):
+        self.path = pathlib.Path(path)
+        self.manifest_path = self.path.with_name(self.path.name + '.manifest.json')
+        self.n_samples = n_samples
+        self.completed = set()
+        self.ordered = False
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if resume and self.path.exists():
+            self._truncate()
+            self.completed = self._read_indices()
+            self.file = self.path.open('ab')
+        else:
+            self.file = self.path.open('wb')
+        self._write_manifest()
+
+    def _truncate(self):
+        if self.manifest_path.exists():
+            manifest = json.loads(self.manifest_path.read_text())
+            if manifest['n_samples'] != self.n_samples:
+                raise ValueError(
+                    f'{self.path} was written for {manifest["n_samples"]} samples, not {self.n_samples}'
+                )
+            size = manifest['size']
+            self.ordered = manifest.get('ordered', False)
+        else:
+            # Written without a manifest, only the complete lines are kept
+            data = self.path.read_bytes()
+            size = data.rfind(b'\n') + 1
+        file_size = self.path.stat().st_size
+        if size > file_size:
+            raise ValueError(
+                f'{self.path} holds {file_size} bytes, but its manifest records {size}: the file was modified or lost '
+                f'data after it was written'
+            )
+        with self.path.open('r+b') as f:
+            f.truncate(size)
+
+    def _read_indices(self) -> set[int]:
+        indices, _ = self._scan()
+        return set(indices.tolist())
+
+    def _scan(self) -> tuple[np.ndarray, np.ndarray]:
+        """The `index` of every record and the offsets of the lines, reading the indices without decoding the records"""
+        indices, offsets = array.array('q'), array.array('q', [0])
+        with self.path.open('rb') as f:
+            for line in f:
+                match = csc.index.INDEX_PATTERN.match(line)
+                indices.append(int(match.group(1)) if match else json.loads(line)['index'])
+                offsets.append(offsets[-1] + len(line))
+        return np.frombuffer(indices, dtype=np.int64), np.frombuffer(offsets, dtype=np.int64)
+
+    def _write_manifest(self):
+        manifest = {
+            'n_samples': self.n_samples,
+            'n_completed': len(self.completed),
+            'size': self.file.tell(),
+            'ordered': self.ordered,
+        }
+        tmp_path = self.manifest_path.with_name(self.manifest_path.name + '.tmp')
+        with tmp_path.open('w') as f:
+            f.write(json.dumps(manifest))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+        # The rename itself is only durable once the directory is synced
+        directory = os.open(self.manifest_path.parent, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    def pending(self) -> list[int]:
+        return [index for index in range(self.n_samples) if index not in self.completed]
+
+    def write_chunk(self, records: typing.Iterable[dict]):
+        """Write the records of a chunk, all candidates of an index being in the same chunk"""
+        for record in records:
+            self.file.write((json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8'))
+            self.completed.add(record['index'])
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self._write_manifest()
+
+    def finalize(self):
+        """
+        Rewrite the file in index order once every sample is written, since scheduled requests (see `plan_requests`)
+        write the chunks out of order. The candidates of a sample keep their order.
+        """
+        if self.ordered or len(self.completed) < self.n_samples:
+            return
+        self.file.flush()
+        indices, offsets = self._scan()
+        if np.any(np.diff(indices) < 0):
+            tmp_path = self.path.with_name(self.path.name + '.tmp')
+            with self.path.open('rb') as f, tmp_path.open('wb') as output:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    for position in np.argsort(indices, kind='stable').tolist():
+                        output.write(data[offsets[position]:offsets[position + 1]])
+                output.flush()
+                os.fsync(output.fileno())
+            self.file.close()
+            os.replace(tmp_path, self.path)
+            self.file = self.path.open('ab')
+        self.ordered = True
+        self._write_manifest()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+@dataclasses.dataclass
+class Completion:
+    """A generated candidate, with the same fields as the completion outputs of vLLM"""
+    text: str
+    token_ids: list[int]
+
+
+class Backend(abc.ABC):
+    """An inference engine generating candidates for tokenized prompts"""
+
+    @abc.abstractmethod
+    def generate(self, inputs: list[dict], n: int, round_: int = 0) -> list[list[Completion]]:
+        """
+        The `n` candidates of every input (`{'prompt_token_ids': ..., 'multi_modal_data': ...}`), `round_` counting
+        the previous calls for the same inputs, so that sampling does not repeat their candidates
+        """
+        raise NotImplementedError
+
+
+class VLLMBackend(Backend):
+
+    def __init__(
+            self,
+            engine_args: dict,
+            get_sampling_params: typing.Callable[[int, int], typing.Any],
+            lora_request: typing.Any = None,
+    ):
+        import vllm
+
+        self.llm = vllm.LLM(**engine_args)
+        self.get_sampling_params = get_sampling_params
+        self.lora_request = lora_request
+
+    def generate(self, inputs: list[dict], n: int, round_: int = 0) -> list[list[Completion]]:
+        results = self.llm.generate(inputs, self.get_sampling_params(n, round_), lora_request=self.lora_request)
+        return [result.outputs for result in results]
+
+
+def sentence_id(sentence: str) -> str:
+    """A stable id of a sentence, the hex of its `csc.context.sentence_hash`"""
+    return f'{csc.context.sentence_hash(sentence):016x}'
+
+
+def source_fields(record: dict) -> dict:
+    """
+    The fields of a dataset record written with its predictions, so that readers need not parse the prompt.
+    The sentence is the `input`, or the `instruction` for the templates which put the task in the `system` prompt.
+    """
+    fields = {
+        'system': record.get('system'),
+        'instruction': record.get('instruction'),
+        'input': record.get('input'),
+        'output': record.get('output'),
+    }
+    sentence = fields['input'] if fields['input'] is not None else fields['instruction']
+    if sentence is not None:
+        fields['sentence_id'] = sentence_id(sentence)
+    return fields
+
+
+def render_prompt(record: dict) -> tuple[str, str]:
+    """
+    The prompt and the label of a dataset record in the chat format of the `deepseek3` template of LlamaFactory,
+    as `vllm-infer.py` decodes them
+    """
+    query = record.get('instruction', '')
+    if record.get('input'):
+        query = f'{query}\n{record["input"]}'
+    prompt = f'<｜begin▁of▁sentence｜>{record.get("system", "")}<｜User｜>{query}<｜Assistant｜>'
+    return prompt, f'{record.get("output") or ""}<｜end▁of▁sentence｜>'
+
+
+def decode_code_points(token_ids: typing.Iterable[int]) -> str:
+    return ''.join(map(chr, token_ids))
+
+
+def encode_code_points(text: str) -> list[int]:
+    return list(map(ord, text))
+
+
+class FakeBackend(Backend):
+    """
+    A deterministic engine for profiling the inference pipeline without GPUs.
+
+    Candidates follow the output format of `template`: a reasoning whose length grows with the sentence, and the
+    sentence with every character tagged as an error with probability `error_rate`. They only depend on the
+    sentence, the seed, the round and their rank. Every call takes `latency` seconds plus the time to generate its
+    tokens at `tokens_per_second`, one token per character.
+    """
+
+    def __init__(
+            self,
+            template: type[csc.evaluation.Template0] = csc.evaluation.Template1,
+            decode: typing.Callable[[list[int]], str] = decode_code_points,
+            encode: typing.Callable[[str], list[int]] = encode_code_points,
+            error_rate: float = 0.02,
+            latency: float = 0.0,
+            tokens_per_second: float | None = None,
+            seed: int = 0,
+    ):
+        self.template = template
+        self.decode = decode
+        self.encode = encode
+        self.error_rate = error_rate
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.seed = seed
+
+    def complete(self, sentence: str, rank: int, round_: int) -> str:
+        key = f'{self.seed}\0{round_}\0{rank}\0{sentence}'.encode('utf-8', 'surrogatepass')
+        rng = random.Random(hashlib.blake2b(key, digest_size=8).digest())
+        tagged = ''.join(
+            f'{self.template.opening_tag}{char}{self.template.closing_tag}' if rng.random() < self.error_rate else char
+            for char in sentence
+        )
+        reasoning = '检查句子中的每一个字。' * (1 + len(sentence) // 20)
+        return f'<think>\n{reasoning}\n</think>\n\n{tagged}'
+
+    def generate(self, inputs: list[dict], n: int, round_: int = 0) -> list[list[Completion]]:
+        outputs = []
+        for input in inputs:
+            sentence = self.template.clean_prompt(self.decode(input['prompt_token_ids']))
+            texts = [self.complete(sentence, rank, round_) for rank in range(n)]
+            outputs.append([Completion(text=text, token_ids=self.encode(text)) for text in texts])
+        seconds = self.latency
+        if self.tokens_per_second:
+            n_tokens = sum(len(output.token_ids) for candidates in outputs for output in candidates)
+            seconds += n_tokens / self.tokens_per_second
+        if seconds > 0:
+            time.sleep(seconds)
+        return outputs
+
+
+def generate_predictions(
+        backend: Backend,
+        inputs: typing.Sequence[dict],
+        prompts: typing.Sequence[str],
+        labels: typing.Sequence[str],
+        requests: list[list[int]],
+        writer: PredictionWriter,
+        n: int,
+        chunk_size: int,
+        adaptive_n: int | None = None,
+        eval_template: type[csc.evaluation.Template0] = csc.evaluation.Template1,
+        sources: typing.Sequence[dict] | None = None,
+        grouped: bool = False,
+) -> ThroughputMeter:
+    """
+    Generate the candidates of the `requests` (see `plan_requests`) chunk by chunk, writing the predictions of every
+    sample of a chunk in index order, then the whole file in index order (see `PredictionWriter.finalize`).
+    With `adaptive_n`, candidates are sampled by `sample_adaptively`.
+    With `sources` (see `source_fields`), the fields of every sample are added to its predictions.
+    With `grouped`, every sample is written as one record holding the list of its candidates (`predicts`) instead of
+    one record per candidate, which `csc.expand_predictions` reads back.
+    """
+    meter = ThroughputMeter()
+    for chunk in iter_chunks(requests, chunk_size):
+
+        def generate(positions: list[int], n_samples: int, round_: int) -> list[list[Completion]]:
+            chunk_inputs = [inputs[chunk[position][0]] for position in positions]
+            meter.start()
+            outputs = backend.generate(chunk_inputs, n_samples, round_)
+            meter.stop(
+                len(chunk_inputs),
+                sum(len(input['prompt_token_ids']) for input in chunk_inputs),
+                sum(len(output.token_ids) for candidates in outputs for output in candidates),
+            )
+            return outputs
+
+        if adaptive_n:
+            outputs = sample_adaptively(
+                generate,
+                len(chunk),
+                adaptive_n,
+                n,
+                lambda candidates: candidates_disagree(eval_template, [candidate.text for candidate in candidates]),
+            )
+        else:
+            outputs = generate(list(range(len(chunk))), n, 0)
+        records = []
+        for request, candidates in zip(chunk, outputs):
+            texts = [output.text for output in candidates]
+            for index in request:
+                fields = {}
+                if adaptive_n:
+                    fields['n_generated'] = len(candidates)
+                if sources is not None:
+                    fields.update(sources[index])
+                if grouped:
+                    records.append({
+                        'index': index, 'prompt': prompts[index], 'predicts': texts, 'label': labels[index], **fields,
+                    })
+                    continue
+                for text in texts:
+                    records.append({
+                        'index': index, 'prompt': prompts[index], 'predict': text, 'label': labels[index], **fields,
+                    })
+        writer.write_chunk(sorted(records, key=lambda record: record['index']))
+    writer.finalize()
+    return meter
+
+
+def file_digest(path: str | pathlib.Path, chunk_size: int = 1 << 20) -> str:
+    hasher = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def split_affixes(token_ids: list[int], middle: list[int]) -> tuple[list[int], list[int]] | None:
+    """`(prefix, suffix)` such that `token_ids == prefix + middle + suffix`, taking the last occurrence of `middle`"""
+    for start in range(len(token_ids) - len(middle), -1, -1):
+        if token_ids[start:start + len(middle)] == middle:
+            return token_ids[:start], token_ids[start + len(middle):]
+    return None
+
+
+def _round_trip_window(
+        token_ids: list[int],
+        decode: typing.Callable[[list[int]], str],
+        encode_texts: typing.Callable[[list[str]], list[list[int]]],
+        window: int,
+        at_end: bool,
+) -> tuple[int, str] | None:
+    """
+    The largest number of tokens, up to `window`, at the end (`at_end`) or at the start of `token_ids` whose decoded
+    text encodes back to the same tokens, and that text
+    """
+    if not token_ids:
+        return 0, ''
+    sizes = range(min(window, len(token_ids)), 0, -1)
+    parts = [token_ids[len(token_ids) - size:] if at_end else token_ids[:size] for size in sizes]
+    texts = [decode(part) for part in parts]
+    for size, part, text, encoded in zip(sizes, parts, texts, encode_texts(texts)):
+        if encoded == part:
+            return size, text
+    return None
+
+
+def _encode_between(
+        prefix: list[int],
+        suffix: list[int],
+        texts: list[str],
+        decode: typing.Callable[[list[int]], str],
+        encode_texts: typing.Callable[[list[str]], list[list[int]]],
+        window: int,
+) -> list[list[int] | None] | None:
+    """
+    The token ids of `prefix`, each text and `suffix` as if they were encoded together. Every text is encoded with the
+    text of the `window` tokens around it, and the ids of these tokens must come back unchanged, otherwise the
+    tokenizer merges across the boundary and the text gets None. None for all the texts when the tokens around them
+    cannot be decoded and encoded back (e.g. a window cutting a character in two).
+    """
+    head = _round_trip_window(prefix, decode, encode_texts, window, at_end=True)
+    tail = _round_trip_window(suffix, decode, encode_texts, window, at_end=False)
+    if head is None or tail is None:
+        return None
+    (n_head, head_text), (n_tail, tail_text) = head, tail
+    head_ids, tail_ids = prefix[len(prefix) - n_head:], suffix[:n_tail]
+    results = []
+    for encoded in encode_texts([head_text + text + tail_text for text in texts]):
+        unchanged = encoded[:n_head] == head_ids and encoded[len(encoded) - n_tail:] == tail_ids
+        if len(encoded) < n_head + n_tail or not unchanged:
+            results.append(None)
+        else:
+            results.append(prefix[:len(prefix) - n_head] + encoded + suffix[n_tail:])
+    return results
+
+
+def tokenize_records(
+        records: typing.Sequence[dict],
+        encode_record: typing.Callable[[dict], tuple[list[int], list[int]]],
+        encode_texts: typing.Callable[[list[str]], list[list[int]]],
+        decode: typing.Callable[[list[int]], str],
+        cutoff_len: int,
+        n_checks: int = 8,
+        window: int = 8,
+) -> tuple[list[list[int]], list[list[int]]]:
+    """
+    The prompt and label token ids of dataset records (`system`, `instruction`, `input` and `output`), the same as
+    `encode_record` gives them, but without encoding the records one by one.
+
+    The records sharing their system and instruction (e.g. all the records of a detection dataset) only differ by
+    their input and output. The token ids around them are taken once from the encoding of the shortest record of
+    the group with a non-empty input and output. The input and the output of every record are then encoded in
+    batches by `encode_texts`, together with the decoded `window` tokens on each side, which must be encoded back to
+    the same ids: every boundary of every record is checked, and the records where the tokenizer merges across a
+    boundary are encoded by `encode_record`. The first `n_checks` records of every group are also compared with
+    `encode_record` as a whole, the group being encoded record by record if any differs. Records longer than
+    `cutoff_len`, which `encode_record` truncates, are encoded by `encode_record` too.
+    """
+    prompt_token_ids: list[list[int] | None] = [None] * len(records)
+    label_token_ids: list[list[int] | None] = [None] * len(records)
+    groups = collections.defaultdict(list)
+    for index, record in enumerate(records):
+        key = (
+            record.get('system'),
+            record.get('instruction'),
+            bool(record.get('input')),
+            isinstance(record.get('output'), str),
+        )
+        groups[key].append(index)
+    for indices in groups.values():
+        input_texts = [records[index].get('input') or '' for index in indices]
+        output_texts = [records[index].get('output') or '' for index in indices]
+        # an empty input or output could be cut anywhere out of the tokens around it
+        base = min(range(len(indices)), key=lambda position: (
+            not input_texts[position],
+            not output_texts[position],
+            len(input_texts[position]) + len(output_texts[position]),
+        ))
+        base_prompt, base_label = encode_record(records[indices[base]])
+        base_input, base_output = encode_texts([input_texts[base], output_texts[base]])
+        prompt_affixes = split_affixes(base_prompt, base_input)
+        label_affixes = split_affixes(base_label, base_output)
+        prompts, labels = None, None
+        if prompt_affixes is not None and label_affixes is not None:
+            prompts = _encode_between(*prompt_affixes, input_texts, decode, encode_texts, window)
+            labels = _encode_between(*label_affixes, output_texts, decode, encode_texts, window)
+        if prompts is not None and labels is not None:
+            for position in range(min(n_checks, len(indices))):
+                prompt, label = prompts[position], labels[position]
+                if prompt is None or label is None or len(prompt) + len(label) > cutoff_len:
+                    continue
+                if (prompt, label) != encode_record(records[indices[position]]):
+                    prompts, labels = None, None
+                    break
+        for position, index in enumerate(indices):
+            if prompts is not None and labels is not None:
+                prompt, label = prompts[position], labels[position]
+                if prompt is not None and label is not None and len(prompt) + len(label) <= cutoff_len:
+                    prompt_token_ids[index], label_token_ids[index] = prompt, label
+                    continue
+            prompt_token_ids[index], label_token_ids[index] = encode_record(records[index])
+    return prompt_token_ids, label_token_ids
+
+
+def token_cache_key(**fields) -> str:
+    """Digest of everything the cached token ids depend on, e.g. the dataset digest, template and tokenizer"""
+    fields = {'version': TokenCache.version, **fields}
+    return hashlib.blake2b(json.dumps(fields, sort_keys=True).encode('utf-8'), digest_size=16).hexdigest()
+
+
+class TokenCache:
+    """
+    The prompt token ids, prompts and labels of a dataset, so that later runs over the same dataset skip tokenizing.
+
+    An entry is the directory `root / key` holding the concatenated prompt token ids (`token_ids.npy`), the offsets of
+    every prompt in them (`offsets.npy`) and the decoded prompts and labels (`texts.jsonl`). It is written in a
+    temporary directory which is renamed at the end, so that an interrupted run never leaves a partial entry.
+    """
+    version = 2
+    token_ids_file = 'token_ids.npy'
+    offsets_file = 'offsets.npy'
+    texts_file = 'texts.jsonl'
+
+    def __init__(self, root: str | pathlib.Path, key: str):
+        self.path = pathlib.Path(root) / key
+
+    def exists(self) -> bool:
+        return self.path.is_dir()
+
+    def load(self) -> tuple[list[list[int]], list[str], list[str]]:
+        token_ids = np.load(self.path / self.token_ids_file).tolist()
+        offsets = np.load(self.path / self.offsets_file).tolist()
+        prompt_token_ids = [token_ids[start:end] for start, end in zip(offsets, offsets[1:])]
+        prompts, labels = [], []
+        with (self.path / self.texts_file).open(encoding='utf-8') as f:
+            for line in f:
+                prompt, label = json.loads(line)
+                prompts.append(prompt)
+                labels.append(label)
+        return prompt_token_ids, prompts, labels
+
+    def save(
+            self,
+            prompt_token_ids: typing.Sequence[list[int]],
+            prompts: typing.Sequence[str],
+            labels: typing.Sequence[str],
+    ):
+        temp_path = self.path.with_name(f'{self.path.name}.{os.getpid()}.tmp')
+        temp_path.mkdir(parents=True, exist_ok=True)
+        offsets = np.zeros(len(prompt_token_ids) + 1, dtype=np.int64)
+        np.cumsum([len(token_ids) for token_ids in prompt_token_ids], out=offsets[1:])
+        token_ids = np.fromiter(itertools.chain.from_iterable(prompt_token_ids), dtype=np.int32, count=int(offsets[-1]))
+        np.save(temp_path / self.token_ids_file, token_ids)
+        np.save(temp_path / self.offsets_file, offsets)
+        with (temp_path / self.texts_file).open('w', encoding='utf-8') as f:
+            for prompt, label in zip(prompts, labels):
+                f.write(json.dumps([prompt, label], ensure_ascii=False) + '\n')
+        if self.path.exists():
+            shutil.rmtree(self.path)
+        temp_path.rename(self.path)
@@ -0,0 +1,73 @@
+import typing
+import collections
+
+
+class AhoCorasick:
+    """
+    Multi-pattern string matcher, compiled once from a dictionary and then used to scan texts in a single pass.
+    """
+
+    def __init__(self, patterns: typing.Iterable[str]):
+        self.goto: list[dict[str, int]] = [{}]
+        self.fail: list[int] = [0]
+        # Length of the longest pattern ending at each state, following the failure links (0 if none)
+        self.longest: list[int] = [0]
+        for pattern in patterns:
+            if pattern:
+                self._add(pattern)
+        self._link()
+
+    def _add(self, pattern: str):
+        state = 0
+        for char in pattern:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.longest.append(0)
+            state = next_state
+        self.longest[state] = max(self.longest[state], len(pattern))
+
+    def _link(self):
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                fail = self.goto[fail].get(char, 0)
+                self.fail[next_state] = fail
+                self.longest[next_state] = max(self.longest[next_state], self.longest[fail])
+
+    def __bool__(self) -> bool:
+        return len(self.goto) > 1
+
+    def iter_longest(self, text: str) -> typing.Iterator[tuple[int, int]]:
+        """Yield `(end, length)` for every position with a match ending there, `length` being the longest match."""
+        goto, fail, longest = self.goto, self.fail, self.longest
+        state = 0
+        for end, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if longest[state]:
+                yield end, longest[state]
+
+    def covered(self, text: str) -> list[bool]:
+        """Mark every position of `text` which lies inside an occurrence of any pattern."""
+        covered = [False] * len(text)
+        if not self:
+            return covered
+        starts = [len(text)] * len(text)
+        for end, length in self.iter_longest(text):
+            starts[end] = end - length + 1
+        # A position is covered if any match ending at or after it starts at or before it
+        min_start = len(text)
+        for position in range(len(text) - 1, -1, -1):
+            min_start = min(min_start, starts[position])
+            covered[position] = min_start <= position
+        return covered
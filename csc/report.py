@@ -2,7 +2,9 @@ from __future__ import annotations
 
 import abc
 import enum
+import queue
 import pathlib
+import threading
 
 import csc
 
@@ -21,10 +23,18 @@ class OutputMode(enum.IntFlag):
 
 
 class ReportManager:
+    """
+    Dispatches entries to the enabled reports.
+    Entries are written by a background thread through a bounded queue, so the caller never waits on the filesystem
+    unless the queue is full. `write_tail` flushes the queue and closes every report.
+    """
 
-    def __init__(self, config: csc.evaluation.EvaluationConfig):
+    def __init__(self, config: csc.evaluation.EvaluationConfig, queue_size: int = 4096):
         self.config = config
         self.reports = {}
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.error = None
 
     def init(self):
         if self.config.report_path.exists():
@@ -54,22 +64,84 @@ class ReportManager:
     def write_head(self):
         for report in self.reports.values():
             report.write_head()
+        self.thread = threading.Thread(target=self._write_entries, name='report-writer', daemon=True)
+        self.thread.start()
 
     def write_tail(self, result: csc.evaluation.EvaluationResult):
+        self.close()
         for report in self.reports.values():
             report.write_tail(result)
+            report.close()
 
     def write_entry(self, tp: int, fp: int, fn: int, length: int, *args, **kwargs):
+        if self.thread is None:
+            self._write_entry(tp, fp, fn, length, *args, **kwargs)
+        else:
+            self.queue.put((tp, fp, fn, length, args, kwargs))
+
+    def _write_entry(self, tp: int, fp: int, fn: int, length: int, *args, **kwargs):
         for report in self.reports.values():
             if report.should_pick(tp, fp, fn, length):
                 report.write_entry(*args, **kwargs)
 
+    def _write_entries(self):
+        while True:
+            entry = self.queue.get()
+            try:
+                if entry is None:
+                    return
+                # Keep draining after a failure so that the producer is never blocked on a full queue
+                if self.error is None:
+                    tp, fp, fn, length, args, kwargs = entry
+                    self._write_entry(tp, fp, fn, length, *args, **kwargs)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError('Failed to write report entries') from error
+
+    def flush(self):
+        """Wait until every queued entry is written and flush the buffered files."""
+        if self.thread is not None:
+            self.queue.join()
+        self._raise_error()
+        for report in self.reports.values():
+            report.flush()
+
+    def close(self):
+        """Write the remaining entries and stop the background writer."""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        self._raise_error()
+
 
 class Report(abc.ABC):
 
     def __init__(self, path: pathlib.Path, filter_: Filter | None = None):
         self.path = path
         self.filter = filter_
+        self.files = {}
+
+    def open(self, path: pathlib.Path):
+        """Return a buffered handle appending to `path`, which stays open until the report is closed."""
+        if path not in self.files:
+            self.files[path] = path.open('a')
+        return self.files[path]
+
+    def flush(self):
+        for file in self.files.values():
+            file.flush()
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+        self.files = {}
 
     def write_head(self):
         pass
@@ -130,19 +202,17 @@ class HTMLReport(Report):
         self.path.write_text(self.html_head)
 
     def write_tail(self, _):
-        with self.path.open('a') as f:
-            f.write(self.html_tail)
+        self.open(self.path).write(self.html_tail)
 
     def write_entry(
             self,
-            item: dict,
-            template: csc.evaluation.Template,
+            parsed: csc.evaluation.ParsedItem,
             label_array: list[bool],
             predict_array: list[bool],
             *_,
             **__,
     ):
-        prompt = template.clean_prompt(item['prompt'])
+        prompt = parsed.prompt
         if len(prompt) == len(label_array) == len(predict_array):
             output_string = []
             for c_text, b_label, b_predict in zip(prompt, label_array, predict_array):
@@ -157,8 +227,7 @@ class HTMLReport(Report):
             entry = f'<div class="csc-pair">{''.join(output_string)}</div>\n'
         else:
             entry = ''
-        with self.path.open('a') as f:
-            f.write(entry)
+        self.open(self.path).write(entry)
 
 
 class JSONReport(Report):
@@ -191,35 +260,21 @@ class ExtractReport(Report):
         if OutputMode.PLAIN_TEXT in self.mode:
             self.plain_text_path.write_text('')
 
-    def write_entry(self, item: dict, template: csc.evaluation.Template, *_, **__):
-        prompt = template.clean_prompt(item['prompt'])
-        label = template.clean_label(item['label'])
-        predict = template.clean_predict(item['predict'])
-        if hasattr(template, 'clean_reasoning') and callable(template.clean_reasoning):
-            new_item = {
-                'index': item.get('index') or self.index,
-                'input': prompt,
-                'reasoning': template.clean_reasoning(item['predict']),
-                'output': predict,
-                'label': label,
-            }
-        else:
-            new_item = {
-                'index': item.get('index') or self.index,
-                'input': prompt,
-                'output': predict,
-                'label': label,
-            }
+    def write_entry(self, parsed: csc.evaluation.ParsedItem, *_, **__):
+        item, predict = parsed.item, parsed.predict
+        new_item = {
+            'index': item.get('index') or self.index,
+            'input': parsed.prompt,
+            'reasoning': parsed.reasoning,
+            'output': predict,
+            'label': parsed.label,
+        }
         if OutputMode.JSONL in self.mode:
-            with self.jsonl_path.open('a') as f:
-                f.write(csc.prettify(item, indent=None) + '\n')
+            self.open(self.jsonl_path).write(csc.prettify(item, indent=None) + '\n')
         if OutputMode.JSONL in self.mode:
-            with self.cleaned_jsonl_path.open('a') as f:
-                f.write(csc.prettify(new_item, indent=None) + '\n')
+            self.open(self.cleaned_jsonl_path).write(csc.prettify(new_item, indent=None) + '\n')
         if OutputMode.HUMAN_READABLE in self.mode:
-            with self.human_readable_path.open('a') as f:
-                f.write(csc.prettify(new_item) + '\n')
+            self.open(self.human_readable_path).write(csc.prettify(new_item) + '\n')
         if OutputMode.PLAIN_TEXT in self.mode:
-            with self.plain_text_path.open('a') as f:
-                f.write(predict + '\n')
+            self.open(self.plain_text_path).write(predict + '\n')
         self.index += 1
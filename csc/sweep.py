@@ -0,0 +1,176 @@
+import typing
+import itertools
+import dataclasses
+
+import numpy as np
+
+import csc
+
+
+@dataclasses.dataclass
+class SweepResult:
+    config: csc.evaluation.FilterConfig
+    tp: int = 0
+    fp: int = 0
+    fn: int = 0
+    metrics: csc.evaluation.EvaluationResult.Metric = dataclasses.field(
+        default_factory=csc.evaluation.EvaluationResult.Metric,
+    )
+
+    def to_row(self) -> dict:
+        return {
+            'enabled': self.config.enabled,
+            'context_threshold': self.config.context_threshold,
+            'context_compare_length': self.config.context_compare_length,
+            'whitelist_compare_range': list(self.config.whitelist_compare_range),
+            'tp': self.tp,
+            'fp': self.fp,
+            'fn': self.fn,
+            'precision': self.metrics.precision,
+            'recall': self.metrics.recall,
+            'f1': self.metrics.f1,
+        }
+
+
+def make_grid(
+        base: csc.evaluation.FilterConfig,
+        context_threshold: typing.Iterable[int] | None = None,
+        context_compare_length: typing.Iterable[int] | None = None,
+        whitelist_compare_range: typing.Iterable[list[int]] | None = None,
+) -> list[csc.evaluation.FilterConfig]:
+    """Every combination of the given values, the other fields (whitelists, contexts) being shared with `base`"""
+    return [
+        dataclasses.replace(
+            base,
+            context_threshold=threshold,
+            context_compare_length=compare_length,
+            whitelist_compare_range=list(compare_range),
+        )
+        for threshold, compare_length, compare_range in itertools.product(
+            context_threshold or [base.context_threshold],
+            context_compare_length or [base.context_compare_length],
+            whitelist_compare_range or [base.whitelist_compare_range],
+        )
+    ]
+
+
+def _whitelisted_lengths(position: int, text: str, whitelist: set[str], lengths: list[int]) -> set[int]:
+    """Lengths of the whitelisted words covering `position`, see `Template0._is_whitelisted`"""
+    found = set()
+    for length in lengths:
+        for l_offset in range(max(position - (length - 1), 0), min(position + 1, len(text) - length + 1)):
+            if text[l_offset:l_offset + length] in whitelist:
+                found.add(length)
+                break
+    return found
+
+
+def _max_context_count(position: int, text: str, count: typing.Callable[[str], int], length: int) -> int | None:
+    """Highest number of occurrences in the context of a substring covering `position`, see `_is_frequent_in_context`"""
+    counts = [
+        count(text[l_offset:l_offset + length])
+        for l_offset in range(max(position - (length - 1), 0), min(position + 1, len(text) - length + 1))
+    ]
+    return max(counts, default=None)
+
+
+class Sweep:
+    """
+    Evaluates many filter configurations in one pass over the data.
+
+    Every item is parsed once, and the whitelist and context lookups of its errors are done once for all the
+    configurations. Each configuration only decides which errors it keeps; the distinct filtered predictions
+    of a shard are then scored together by `Template.eval_batch`.
+    All configurations must share their whitelists and contexts, e.g. the ones built by `make_grid`.
+    """
+
+    def __init__(self, template: int, configs: list[csc.evaluation.FilterConfig], shard_size: int = 256):
+        if not configs:
+            raise ValueError('The sweep needs at least one filter configuration')
+        self.template = csc.evaluation.templates[template]
+        self.configs = configs
+        self.shard_size = shard_size
+        base = configs[0]
+        for config in configs:
+            if any(getattr(config, name) is not getattr(base, name) for name in (
+                    'label_whitelist',
+                    'predict_whitelist',
+                    'context_dict',
+                    'query_dict',
+            )):
+                raise ValueError('All filter configurations of a sweep must share their whitelists and contexts')
+        self.label_whitelist = base.label_whitelist
+        self.predict_whitelist = base.predict_whitelist
+        enabled = [config for config in configs if config.enabled]
+        self.whitelist_lengths = sorted({length for config in enabled for length in config.whitelist_compare_range})
+        self.context_compare_lengths = sorted({config.context_compare_length for config in enabled})
+        # Only used for the context lookups, which do not depend on the swept values
+        self.evaluator = csc.evaluation.ItemEvaluator(self.template, dataclasses.replace(base, enabled=False))
+
+    def _pairs(self, item: dict) -> list[tuple[str, str]]:
+        """The label and the prediction to score for every configuration, as `ItemEvaluator.prepare` would give"""
+        parsed = self.template.parse(item)
+        raw = parsed.label, parsed.predict
+        if not self.context_compare_lengths:
+            return [raw] * len(self.configs)
+        _, context = self.evaluator.get_context(parsed.prompt)
+        counts = {}
+
+        def count(substr: str) -> int:
+            if substr not in counts:
+                counts[substr] = context.count(substr)
+            return counts[substr]
+
+        label = self.template.filter_marked(parsed.label_mask, parsed.label_text, self.label_whitelist)
+        text = parsed.predict_text
+        errors = [i for i, marked in enumerate(parsed.predict_mask) if marked]
+        whitelisted = {i: _whitelisted_lengths(i, text, self.predict_whitelist, self.whitelist_lengths) for i in errors}
+        context_counts = {
+            (i, length): _max_context_count(i, text, count, length)
+            for i in errors
+            for length in self.context_compare_lengths
+        }
+
+        def is_filtered(i: int, config: csc.evaluation.FilterConfig) -> bool:
+            if not whitelisted[i].isdisjoint(config.whitelist_compare_range):
+                return True
+            n = context_counts[i, config.context_compare_length]
+            return n is not None and n > config.context_threshold
+
+        predicts = {}
+        pairs = []
+        for config in self.configs:
+            if not config.enabled:
+                pairs.append(raw)
+                continue
+            removed = frozenset(i for i in errors if is_filtered(i, config))
+            if removed not in predicts:
+                predict_mask = [marked and i not in removed for i, marked in enumerate(parsed.predict_mask)]
+                predicts[removed] = self.template.render_marked(predict_mask, text)
+            pairs.append((label, predicts[removed]))
+        return pairs
+
+    def eval(self, data: typing.Iterable[dict]) -> list[SweepResult]:
+        totals = np.zeros((len(self.configs), 3), dtype=np.int64)
+        has_label = np.zeros(len(self.configs), dtype=bool)
+        for shard in csc.evaluation.iter_shards(csc.expand_predictions(data), self.shard_size):
+            labels, predicts, pair_ids = [], [], {}
+            choices = np.empty((len(self.configs), len(shard)), dtype=np.int64)
+            for j, item in enumerate(shard):
+                for k, pair in enumerate(self._pairs(item)):
+                    # Most configurations agree on most items, each distinct pair is scored once
+                    if pair not in pair_ids:
+                        pair_ids[pair] = len(labels)
+                        labels.append(pair[0])
+                        predicts.append(pair[1])
+                    choices[k, j] = pair_ids[pair]
+            score = self.template.eval_batch(labels, predicts)
+            totals += np.stack([score.tp, score.fp, score.fn], axis=1)[choices].sum(axis=1)
+            has_label |= (np.diff(score.label_offsets) > 0)[choices].any(axis=1)
+        results = []
+        for config, (tp, fp, fn), config_has_label in zip(self.configs, totals.tolist(), has_label):
+            result = SweepResult(config=config, tp=tp, fp=fp, fn=fn)
+            if config_has_label:
+                result.metrics = csc.evaluation.EvaluationResult.Metric.from_counts(tp, fp, fn)
+            results.append(result)
+        return results
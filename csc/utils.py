@@ -1,9 +1,52 @@
 import json
 import yaml
+import typing
 import pathlib
 import dataclasses
 
 
+def iter_file(path: str | pathlib.Path, file_type: str | None = None) -> typing.Iterator:
+    """Lazily yield the records of a line-based file (`jsonl`, `txt`, `tsv` or `csv`) one at a time."""
+    path = pathlib.Path(path)
+    if file_type is None:
+        file_type = path.suffix[1:]
+    if file_type == 'jsonl':
+        with path.open() as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+    if file_type in {'txt', 'tsv', 'csv'}:
+        with path.open() as f:
+            for line in f:
+                yield from (sub_line for sub_line in line.splitlines() if sub_line)
+        return
+    raise ValueError(f'Unsupported file type for iteration: {file_type}')
+
+
+def expand_predictions(records: typing.Iterable[dict]) -> typing.Iterator[dict]:
+    """
+    One record per candidate from predictions in either format, expanding the grouped records (one record per sample
+    with the list of its `predicts`, see `csc.inference.generate_predictions`) lazily. The expanded records share the
+    prompt and the label of their sample, and have the fields of the records written one per candidate, in order.
+    """
+    for record in records:
+        predicts = record.get('predicts')
+        if not isinstance(predicts, list):
+            yield record
+            continue
+        keys = ['predict' if key == 'predicts' else key for key in record]
+        values = list(record.values())
+        position = keys.index('predict')
+        for predict in predicts:
+            values[position] = predict
+            yield dict(zip(keys, values))
+
+
+def iter_predictions(path: str | pathlib.Path) -> typing.Iterator[dict]:
+    return expand_predictions(iter_file(path))
+
+
 def load_file(path: str | pathlib.Path, file_type: str | None = None):
     path = pathlib.Path(path)
     if file_type is None:
@@ -11,7 +54,7 @@ def load_file(path: str | pathlib.Path, file_type: str | None = None):
     if file_type == 'json':
         return json.loads(path.read_text())
     if file_type == 'jsonl':
-        return [json.loads(line) for line in path.read_text().splitlines() if line]
+        return list(iter_file(path, file_type))
     if file_type == 'yaml':
         return yaml.safe_load(path.read_text())
     if file_type == 'pkl':
@@ -25,7 +68,7 @@ def load_file(path: str | pathlib.Path, file_type: str | None = None):
                     break
         return tuple(objs)
     if file_type in {'txt', 'tsv', 'csv'}:
-        return [line for line in path.read_text().splitlines() if line]
+        return list(iter_file(path, file_type))
     raise ValueError(f'Unsupported file type: {file_type}')
 
 
@@ -1,9 +1,10 @@
+import typing
 import pathlib
 
 import csc
 
 
-def deduplicate_results(results: list[dict]) -> list[dict]:
+def deduplicate_results(results: typing.Iterable[dict]) -> list[dict]:
     new_results = []
     temp_output = None
     for result in results:
@@ -22,10 +23,14 @@ class Dataset:
         self.corrected_samples = []
         self.data = []
 
-    def load_data(self, deduplicate: bool = True):
-        self.csc_outputs = csc.load_file(self.path)
+    def load_data(self, deduplicate: bool = True, data: typing.Iterable[dict] | None = None):
+        if data is None:
+            data = csc.iter_file(self.path)
+        data = csc.expand_predictions(data)
         if deduplicate:
-            self.csc_outputs = deduplicate_results(self.csc_outputs)
+            self.csc_outputs = deduplicate_results(data)
+        else:
+            self.csc_outputs = list(data)
 
     def get_corrected_samples(self, save: bool = True):
         if not self.csc_outputs:
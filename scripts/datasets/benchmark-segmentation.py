@@ -0,0 +1,63 @@
+import fire
+import time
+import tqdm
+import pathlib
+
+import csc
+
+from csc.data.datasets import stcn
+
+
+def best_time(function, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(
+        root: str,
+        limit: int | None = None,
+        repeat: int = 3,
+):
+    """
+    Compare the fast segmenter, the sentence offsets and the compiled blacklist with the original implementations
+    on the `article.json` files under `root` (e.g. an STCN or tianjindaily archive)
+    """
+    files = sorted(pathlib.Path(root).rglob('article.json'))[:limit]
+    contents = [csc.load_file(file)['content'] for file in tqdm.tqdm(files, desc='Reading articles')]
+
+    def segment(split_sentences):
+        return [[stcn.clean_text(sentence) for sentence in split_sentences(content)] for content in contents]
+
+    def keep(should_output, articles):
+        return [[sentence for sentence in sentences if should_output(sentence)] for sentences in articles]
+
+    articles = segment(csc.data.utils.split_sentences_regex)
+    if segment(csc.data.utils.split_sentences) != articles:
+        raise AssertionError('The segmenters disagree')
+    if keep(stcn.should_output, articles) != keep(stcn.should_output_by_rules, articles):
+        raise AssertionError('The blacklist filters disagree')
+
+    results = {
+        'n_articles': len(contents),
+        'n_chars': sum(map(len, contents)),
+        'n_sentences': sum(map(len, articles)),
+    }
+    for name, original, compiled in (
+            ('segmentation', csc.data.utils.split_sentences_regex, csc.data.utils.split_sentences),
+            ('spans', csc.data.utils.split_sentences_regex, csc.data.utils.split_sentence_spans),
+    ):
+        original_time = best_time(lambda: [original(content) for content in contents], repeat)
+        compiled_time = best_time(lambda: [compiled(content) for content in contents], repeat)
+        results[name] = {'original': original_time, 'compiled': compiled_time, 'speedup': original_time / compiled_time}
+    original_time = best_time(lambda: keep(stcn.should_output_by_rules, articles), repeat)
+    compiled_time = best_time(lambda: keep(stcn.should_output, articles), repeat)
+    results['filter'] = {'original': original_time, 'compiled': compiled_time, 'speedup': original_time / compiled_time}
+    print(csc.prettify(results))
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
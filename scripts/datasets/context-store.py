@@ -0,0 +1,25 @@
+import fire
+import pathlib
+
+import csc
+
+
+def main(
+        path: str,
+        output_path: str | None = None,
+):
+    """Convert a pickled context file (`context.pkl`) to a context store (`context.sqlite`)"""
+    path = pathlib.Path(path)
+    output_path = pathlib.Path(output_path) if output_path else path.with_suffix('.sqlite')
+    context_dict, query_dict = csc.load_file(path)
+    store = csc.context.ContextStore.build(output_path, context_dict, query_dict)
+    print(csc.prettify({
+        'n_contexts': len(store.contexts),
+        'n_queries': len(store.queries),
+        'path': output_path.resolve().absolute(),
+    }))
+    store.close()
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
@@ -11,14 +11,14 @@ def main(
         input_root: str = '../..',
         output_root: str = '../../datasets/processed',
         context_root: str = '../../datasets/context',
+        workers: int = 1,
+        compact: bool = False,
+        context_store: bool = False,
 ):
     dataset_config = csc.data.utils.load_dataset_config(dataset_config, input_root, variant)
     dataset_class = csc.data.datasets[dataset_config['name']]
-    dataset = dataset_class(dataset_config, template, variant)
-    dataset.load_data()
-    dataset.split_data(train_test_split)
-    dataset.save_data(output_root)
-    dataset.save_context(context_root)
+    dataset = dataset_class(dataset_config, template, variant, workers=workers)
+    dataset.build(output_root, context_root, train_test_split, compact, context_store)
 
 
 if __name__ == '__main__':
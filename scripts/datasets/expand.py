@@ -0,0 +1,23 @@
+import fire
+import pathlib
+
+import csc
+
+
+def main(
+        path: str,
+        output_path: str | None = None,
+):
+    """Write a compact dataset file (`*.compact.jsonl`) as a Llama-Factory compatible JSONL file"""
+    path = pathlib.Path(path)
+    if output_path is None:
+        output_path = path.with_name(path.name.removesuffix(csc.data.base.COMPACT_SUFFIX) + '.jsonl')
+    n_records = csc.data.base.expand_compact_file(path, output_path)
+    print(csc.prettify({
+        'n_samples': n_records,
+        'path': pathlib.Path(output_path).resolve().absolute(),
+    }))
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
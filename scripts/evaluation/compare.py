@@ -0,0 +1,33 @@
+import fire
+import numpy as np
+
+import csc
+
+
+def main(
+        report_path: str,
+        baseline_report_path: str,
+        n_resamples: int = 1000,
+        confidence: float = 0.95,
+        seed: int = 0,
+):
+    """Paired bootstrap between two runs evaluated with `--bootstrap_enabled=True` on the same data"""
+    indices, counts = csc.bootstrap.load_counts(report_path)
+    baseline_indices, baseline_counts = csc.bootstrap.load_counts(baseline_report_path)
+    if not np.array_equal(indices, baseline_indices):
+        raise ValueError(f'{report_path} and {baseline_report_path} were not evaluated on the same samples')
+    differences = csc.bootstrap.paired_bootstrap(counts, baseline_counts, n_resamples, confidence, seed)
+    result = csc.evaluation.EvaluationResult.PairedBootstrap(
+        baseline=baseline_report_path,
+        n_resamples=n_resamples,
+        confidence=confidence,
+        **{
+            name: csc.evaluation.EvaluationResult.PairedBootstrap.Difference(*values)
+            for name, values in differences.items()
+        },
+    )
+    print(csc.prettify(csc.dataclass_to_cleaned_dict(result)))
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
@@ -30,6 +30,14 @@ def main(
         filter_output_label_whitelist_path: list[str] | None = None,
         filter_output_predict_whitelist_path: list[str] | None = None,
         filter_output_context_path: str | None = None,
+        filter_output_context_index: bool = False,
+        filter_output_sentence_index: bool = False,
+        bootstrap_enabled: bool = False,
+        bootstrap_n_resamples: int = 1000,
+        bootstrap_confidence: float = 0.95,
+        bootstrap_baseline_path: str | None = None,
+        workers: int = 1,
+        cache: bool = False,
 ):
     path = pathlib.Path(path)
     if run_name is None:
@@ -49,27 +57,25 @@ def main(
             filter=parse_enum(csc.report.Filter, extract_output_filter),
             mode=parse_enum(csc.report.OutputMode, extract_output_mode),
         ),
-        filter_output=csc.evaluation.FilterConfig(
-            enabled=filter_output_enabled,
-        )
+        bootstrap=csc.evaluation.BootstrapConfig(
+            enabled=bootstrap_enabled,
+            n_resamples=bootstrap_n_resamples,
+            confidence=bootstrap_confidence,
+            baseline_path=bootstrap_baseline_path,
+        ),
+        cache_path=pathlib.Path(report_root) / '.cache' / 'evaluation.sqlite' if cache else None,
     )
     if filter_output_enabled:
-        label_whitelist, predict_whitelist = set(), set()
-        if filter_output_label_whitelist_path:
-            for label_whitelist_path in filter_output_label_whitelist_path:
-                label_whitelist.update(csc.load_file(label_whitelist_path))
-        if filter_output_predict_whitelist_path:
-            for predict_whitelist_path in filter_output_predict_whitelist_path:
-                predict_whitelist.update(csc.load_file(predict_whitelist_path))
-        config.filter_output.label_whitelist = label_whitelist
-        config.filter_output.predict_whitelist = predict_whitelist
-        if filter_output_context_path:
-            config.filter_output.context_dict, config.filter_output.query_dict = csc.load_file(
-                filter_output_context_path,
-            )
+        config.filter_output = csc.evaluation.load_filter_config(
+            filter_output_label_whitelist_path,
+            filter_output_predict_whitelist_path,
+            filter_output_context_path,
+            filter_output_context_index,
+            filter_output_sentence_index,
+        )
 
-    data = csc.load_file(path)
-    metric = csc.evaluation.Metric(config, template)
+    data = csc.iter_file(path)
+    metric = csc.evaluation.Metric(config, template, workers=workers)
     result = metric.eval(data)
     print(csc.prettify(csc.dataclass_to_cleaned_dict(result)))
 
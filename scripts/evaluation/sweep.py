@@ -0,0 +1,58 @@
+import fire
+import json
+import pathlib
+
+import csc
+
+
+def format_table(rows: list[dict]) -> str:
+    def format_value(value) -> str:
+        if isinstance(value, float):
+            return f'{value:.4f}'
+        if value is None:
+            return '-'
+        return str(value)
+
+    columns = list(rows[0])
+    cells = [columns] + [[format_value(row[column]) for column in columns] for row in rows]
+    widths = [max(len(line[i]) for line in cells) for i in range(len(columns))]
+    return '\n'.join('  '.join(cell.rjust(width) for cell, width in zip(line, widths)) for line in cells)
+
+
+def main(
+        path: str,
+        template: int,
+        context_threshold: list[int] | None = None,
+        context_compare_length: list[int] | None = None,
+        whitelist_compare_range: list[list[int]] | None = None,
+        filter_output_label_whitelist_path: list[str] | None = None,
+        filter_output_predict_whitelist_path: list[str] | None = None,
+        filter_output_context_path: str | None = None,
+        filter_output_context_index: bool = False,
+        filter_output_sentence_index: bool = False,
+        sort_by: str | None = 'f1',
+        output_path: str | None = None,
+):
+    base = csc.evaluation.load_filter_config(
+        filter_output_label_whitelist_path,
+        filter_output_predict_whitelist_path,
+        filter_output_context_path,
+        filter_output_context_index,
+        filter_output_sentence_index,
+    )
+    configs = csc.sweep.make_grid(base, context_threshold, context_compare_length, whitelist_compare_range)
+    results = csc.sweep.Sweep(template, configs).eval(csc.iter_file(path))
+    rows = [result.to_row() for result in results]
+    if sort_by:
+        rows.sort(key=lambda row: (row[sort_by] is not None, row[sort_by]), reverse=True)
+    print(format_table(rows))
+    if output_path:
+        output_path = pathlib.Path(output_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        with output_path.open('w', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
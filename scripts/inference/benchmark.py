@@ -0,0 +1,97 @@
+import fire
+import time
+import pathlib
+
+import csc
+
+
+def main(
+        path: str,
+        output_path: str = 'benchmark/generated_predictions.jsonl',
+        limit: int | None = None,
+        n: int = 8,
+        chunk_size: int = 1024,
+        deduplicate_prompts: bool = False,
+        prefix_order: bool = False,
+        length_bucket_size: int | None = None,
+        adaptive_n: int | None = None,
+        template: int = 1,
+        source_fields: bool = False,
+        grouped_output: bool = False,
+        error_rate: float = 0.02,
+        latency: float = 0.0,
+        tokens_per_second: float | None = None,
+        seed: int = 0,
+):
+    """
+    Measure the throughput of the inference pipeline of `vllm-infer.py` (prompt building, generation and writing)
+    with `csc.inference.FakeBackend` on a dataset file written by `detection.py`, tokenizing by code points
+    """
+    times = {}
+
+    start = time.perf_counter()
+    records = []
+    for record in csc.data.base.iter_dataset_file(path):
+        records.append(record)
+        if limit is not None and len(records) >= limit:
+            break
+    prompts, labels = map(list, zip(*map(csc.inference.render_prompt, records))) if records else ([], [])
+    times['build_prompts'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    inputs = [
+        {'prompt_token_ids': csc.inference.encode_code_points(prompt), 'multi_modal_data': None} for prompt in prompts
+    ]
+    times['tokenize'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    prompt_token_ids = [input['prompt_token_ids'] for input in inputs]
+    requests = csc.inference.plan_requests(
+        prompt_token_ids,
+        range(len(inputs)),
+        deduplicate=deduplicate_prompts,
+        sort=prefix_order,
+        bucket_size=length_bucket_size,
+    )
+    times['plan_requests'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    eval_template = csc.evaluation.templates[template]
+    backend = csc.inference.FakeBackend(
+        eval_template,
+        error_rate=error_rate,
+        latency=latency,
+        tokens_per_second=tokens_per_second,
+        seed=seed,
+    )
+    with csc.inference.PredictionWriter(output_path, len(inputs)) as writer:
+        meter = csc.inference.generate_predictions(
+            backend,
+            inputs,
+            prompts,
+            labels,
+            requests,
+            writer,
+            n,
+            chunk_size,
+            adaptive_n=adaptive_n,
+            eval_template=eval_template,
+            sources=list(map(csc.inference.source_fields, records)) if source_fields else None,
+            grouped=grouped_output,
+        )
+    times['generate_and_write'] = time.perf_counter() - start
+    times['write'] = times['generate_and_write'] - meter.seconds
+
+    total = sum(times[name] for name in ('build_prompts', 'tokenize', 'plan_requests', 'generate_and_write'))
+    print(csc.prettify({
+        'n_samples': len(inputs),
+        'n_requests': len(requests),
+        'seconds': times,
+        'generation': meter.report(),
+        'samples_per_second': len(inputs) / total if total else None,
+        'output_path': pathlib.Path(output_path).resolve().absolute(),
+    }))
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
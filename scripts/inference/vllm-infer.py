@@ -12,26 +12,95 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
-import pathlib
+import hashlib
+import inspect
+import os
 from typing import Optional
 
 import fire
 from transformers import Seq2SeqTrainingArguments
 
 from llamafactory.data import get_dataset, get_template_and_fix_tokenizer
+from llamafactory.data.processor import UnsupervisedDatasetProcessor
 from llamafactory.extras.constants import IGNORE_INDEX
+from llamafactory.extras.env import VERSION as LLAMAFACTORY_VERSION
 from llamafactory.extras.misc import get_device_count
 from llamafactory.extras.packages import is_vllm_available
 from llamafactory.hparams import get_infer_args
 from llamafactory.model import load_tokenizer
 
+import csc
+
 
 if is_vllm_available():
-    from vllm import LLM, SamplingParams
+    from vllm import SamplingParams
     from vllm.lora.request import LoRARequest
 
 
+BACKENDS = ("vllm", "fake")
+
+
+def find_dataset_file(dataset_dir: str, dataset: str) -> tuple[str, dict]:
+    r"""Find the file of a dataset of `dataset_info.json`, which must be a local text dataset in the alpaca format."""
+    dataset_info = csc.load_file(os.path.join(dataset_dir, "dataset_info.json"))
+    dataset_attr = dataset_info.get(dataset)
+    if dataset_attr is None or "file_name" not in dataset_attr:
+        raise ValueError(f"Only single local datasets are supported, got {dataset}.")
+    columns = dataset_attr.get("columns", {})
+    if dataset_attr.get("formatting", "alpaca") != "alpaca" or any(
+        columns.get(name) for name in ("history", "tools", "images", "videos", "audios")
+    ):
+        raise ValueError(f"Only text datasets in the alpaca format are supported, got {dataset}.")
+    dataset_file = os.path.join(dataset_dir, dataset_attr["file_name"])
+    if not os.path.isfile(dataset_file):
+        raise ValueError(f"Only datasets in a single file are supported, got {dataset_file}.")
+    return dataset_file, dataset_attr
+
+
+def read_dataset_records(dataset_file: str, dataset_attr: dict, max_samples: Optional[int]) -> list[dict]:
+    r"""Read the records of a dataset with the fields of `csc.inference.tokenize_records`, as LlamaFactory maps them."""
+    columns = {"prompt": "instruction", "query": "input", "response": "output", **dataset_attr.get("columns", {})}
+    if dataset_file.endswith(".jsonl"):
+        rows = csc.data.base.iter_dataset_file(dataset_file)
+    else:
+        rows = iter(csc.load_file(dataset_file))
+    records = []
+    for row in rows:
+        if max_samples is not None and len(records) >= max_samples:
+            break
+        records.append({
+            field: row.get(columns[column]) if columns.get(column) else None
+            for field, column in (
+                ("system", "system"), ("instruction", "prompt"), ("input", "query"), ("output", "response")
+            )
+        })
+    return records
+
+
+# the parameters of `UnsupervisedDatasetProcessor._encode_data_example` that the token cache relies on
+ENCODE_PARAMETERS = ("prompt", "response", "system", "tools", "images", "videos", "audios")
+
+
+def check_encode_parameters() -> None:
+    r"""Check that the private LlamaFactory encoder used by the token cache has the expected parameters."""
+    parameters = tuple(inspect.signature(UnsupervisedDatasetProcessor._encode_data_example).parameters)[1:]
+    if parameters != ENCODE_PARAMETERS:
+        raise RuntimeError(
+            f"The token cache does not support LlamaFactory {LLAMAFACTORY_VERSION}, whose dataset processor takes "
+            f"{parameters}, please run without `token_cache_dir`."
+        )
+
+
+def tokenizer_digest(tokenizer) -> str:
+    r"""Hash the vocabulary, merges and special tokens of a tokenizer."""
+    backend_tokenizer = getattr(tokenizer, "backend_tokenizer", None)
+    if backend_tokenizer is not None:
+        state = backend_tokenizer.to_str()
+    else:
+        state = csc.prettify(sorted(tokenizer.get_vocab().items()), indent=None)
+    return hashlib.blake2b(state.encode("utf-8"), digest_size=16).hexdigest()
+
+
 def vllm_infer(
     model_name_or_path: str,
     adapter_name_or_path: str = None,
@@ -53,13 +122,52 @@ def vllm_infer(
     image_max_pixels: int = 768 * 768,
     image_min_pixels: int = 32 * 32,
     n: int = 1,
+    chunk_size: int = 1024,
+    resume: bool = False,
+    deduplicate_prompts: bool = False,
+    prefix_order: bool = False,
+    length_bucket_size: Optional[int] = None,
+    adaptive_n: Optional[int] = None,
+    adaptive_template: int = 1,
+    backend: str = "vllm",
+    fake_template: int = 1,
+    token_cache_dir: Optional[str] = None,
+    source_fields: bool = False,
+    grouped_output: bool = False,
 ):
     r"""Perform batch generation using vLLM engine, which supports tensor parallelism.
 
+    Predictions are written and synced to disk every `chunk_size` requests. With `resume`, the samples already saved
+    by an interrupted run are skipped and the new predictions are appended.
+    With `deduplicate_prompts`, samples with identical prompts are generated once and share their predictions.
+    With `prefix_order`, requests are sorted by prompt so that the prefix cache of the engine is reused.
+    With `length_bucket_size`, requests are grouped by buckets of prompt lengths, so that short and long sequences
+    are not generated together. Once every sample is generated, the file is rewritten in the order of the samples.
+    With `adaptive_n`, only `adaptive_n` candidates are generated at first, and more (up to `n`) only for the samples
+    whose candidates mark different errors according to `csc.evaluation.templates[adaptive_template]`. Every
+    prediction then records the number of candidates of its sample (`n_generated`).
+    With `backend="fake"`, a deterministic fake engine (`csc.inference.FakeBackend`) replaces vLLM, e.g. to test the
+    pipeline without GPUs. Its candidates follow the output format of `csc.evaluation.templates[fake_template]`.
+    With `token_cache_dir`, the prompt token ids, prompts and labels are cached in `token_cache_dir` for the dataset
+    file, template, tokenizer and `cutoff_len`, so that later runs skip tokenization. The prompt around the input is
+    tokenized once for the whole dataset (see `csc.inference.tokenize_records`).
+    With `source_fields`, every prediction also holds the `system`, `instruction`, `input` and `output` of its dataset
+    record and a stable `sentence_id` (see `csc.inference.source_fields`), which the evaluation templates read instead
+    of parsing the prompt and the label.
+    With `grouped_output`, every sample is written once with the list of its `n` candidates (`predicts`), which the
+    evaluation and verification readers expand (see `csc.expand_predictions`).
+
     Usage: python vllm_infer.py --model_name_or_path meta-llama/Llama-2-7b-hf --template llama --dataset alpaca_en_demo
     """
-    if pipeline_parallel_size > get_device_count():
-        raise ValueError("Pipeline parallel size should be smaller than the number of gpus.")
+    if adaptive_n is not None and not 2 <= adaptive_n <= n:
+        raise ValueError(f"adaptive_n should be between 2 and n ({n}), got {adaptive_n}.")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend}, expected one of {', '.join(BACKENDS)}.")
+    if backend == "vllm":
+        if not is_vllm_available():
+            raise ImportError("vLLM is not installed, pass --backend=fake to run without it.")
+        if pipeline_parallel_size > get_device_count():
+            raise ValueError("Pipeline parallel size should be smaller than the number of gpus.")
 
     model_args, data_args, _, generating_args = get_infer_args(
         dict(
@@ -85,78 +193,189 @@ def vllm_infer(
     tokenizer = tokenizer_module["tokenizer"]
     template_obj = get_template_and_fix_tokenizer(tokenizer, data_args)
     template_obj.mm_plugin.expand_mm_tokens = False  # for vllm generate
-    dataset_module = get_dataset(template_obj, model_args, data_args, training_args, "ppo", **tokenizer_module)
-
-    inputs, prompts, labels = [], [], []
-    for sample in dataset_module["train_dataset"]:
-        if sample["images"]:
-            multi_modal_data = {
-                "image": template_obj.mm_plugin._regularize_images(
-                    sample["images"], image_max_pixels=image_max_pixels, image_min_pixels=image_min_pixels
-                )["images"]
-            }
-        elif sample["videos"]:
-            multi_modal_data = {
-                "video": template_obj.mm_plugin._regularize_videos(
-                    sample["videos"], image_max_pixels=image_max_pixels, image_min_pixels=image_min_pixels
-                )["videos"]
-            }
-        elif sample["audios"]:
-            audio_data = template_obj.mm_plugin._regularize_audios(
-                sample["audios"],
-                sampling_rate=16000,
+    records = None
+    if token_cache_dir is not None:
+        check_encode_parameters()
+        dataset_file, dataset_attr = find_dataset_file(dataset_dir, dataset)
+        token_cache = csc.inference.TokenCache(
+            token_cache_dir,
+            csc.inference.token_cache_key(
+                dataset=csc.inference.file_digest(dataset_file),
+                dataset_attr=dataset_attr,
+                max_samples=max_samples,
+                template=template,
+                tokenizer=tokenizer_digest(tokenizer),
+                cutoff_len=cutoff_len,
+                skip_special_tokens=skip_special_tokens,
+                llamafactory=LLAMAFACTORY_VERSION,
+            ),
+        )
+        if token_cache.exists():
+            prompt_token_ids, prompts, labels = token_cache.load()
+            print(f"Loaded {len(prompts)} tokenized samples from {token_cache.path}.")
+        else:
+            processor = UnsupervisedDatasetProcessor(
+                template=template_obj, tokenizer=tokenizer, processor=tokenizer_module["processor"], data_args=data_args
+            )
+
+            def encode_record(record: dict) -> tuple[list[int], list[int]]:
+                query = "\n".join(part for part in (record["instruction"], record["input"]) if part)
+                response = []
+                if isinstance(record["output"], str):
+                    response.append({"role": "assistant", "content": record["output"]})
+                return processor._encode_data_example(
+                    prompt=[{"role": "user", "content": query}],
+                    response=response,
+                    system=record["system"] or "",
+                    tools="",
+                    images=[],
+                    videos=[],
+                    audios=[],
+                )
+
+            records = read_dataset_records(dataset_file, dataset_attr, max_samples)
+            prompt_token_ids, label_token_ids = csc.inference.tokenize_records(
+                records,
+                encode_record,
+                lambda texts: tokenizer(texts, add_special_tokens=False)["input_ids"],
+                lambda token_ids: tokenizer.decode(
+                    token_ids, skip_special_tokens=False, clean_up_tokenization_spaces=False
+                ),
+                cutoff_len,
+            )
+            prompts = tokenizer.batch_decode(prompt_token_ids, skip_special_tokens=skip_special_tokens)
+            labels = tokenizer.batch_decode(label_token_ids, skip_special_tokens=skip_special_tokens)
+            token_cache.save(prompt_token_ids, prompts, labels)
+            print(f"Saved {len(prompts)} tokenized samples to {token_cache.path}.")
+        inputs = [{"prompt_token_ids": token_ids, "multi_modal_data": None} for token_ids in prompt_token_ids]
+    else:
+        dataset_module = get_dataset(template_obj, model_args, data_args, training_args, "ppo", **tokenizer_module)
+        inputs, prompts, labels = [], [], []
+        for sample in dataset_module["train_dataset"]:
+            if sample["images"]:
+                multi_modal_data = {
+                    "image": template_obj.mm_plugin._regularize_images(
+                        sample["images"], image_max_pixels=image_max_pixels, image_min_pixels=image_min_pixels
+                    )["images"]
+                }
+            elif sample["videos"]:
+                multi_modal_data = {
+                    "video": template_obj.mm_plugin._regularize_videos(
+                        sample["videos"], image_max_pixels=image_max_pixels, image_min_pixels=image_min_pixels
+                    )["videos"]
+                }
+            elif sample["audios"]:
+                audio_data = template_obj.mm_plugin._regularize_audios(
+                    sample["audios"],
+                    sampling_rate=16000,
+                )
+                multi_modal_data = {"audio": zip(audio_data["audios"], audio_data["sampling_rates"])}
+            else:
+                multi_modal_data = None
+
+            inputs.append({"prompt_token_ids": sample["input_ids"], "multi_modal_data": multi_modal_data})
+            prompts.append(tokenizer.decode(sample["input_ids"], skip_special_tokens=skip_special_tokens))
+            labels.append(
+                tokenizer.decode(
+                    list(filter(lambda x: x != IGNORE_INDEX, sample["labels"])), skip_special_tokens=skip_special_tokens
+                )
+            )
+
+    sources = None
+    if source_fields:
+        if records is None:
+            records = read_dataset_records(*find_dataset_file(dataset_dir, dataset), max_samples)
+        if len(records) != len(inputs):
+            raise ValueError(f"Read {len(records)} records of {dataset} for {len(inputs)} samples.")
+        sources = [csc.inference.source_fields(record) for record in records]
+
+    if backend == "vllm":
+        def get_sampling_params(n_samples: int, round_: int = 0) -> "SamplingParams":
+            return SamplingParams(
+                repetition_penalty=generating_args.repetition_penalty or 1.0,  # repetition_penalty must > 0
+                temperature=generating_args.temperature,
+                top_p=generating_args.top_p or 1.0,  # top_p must > 0
+                top_k=generating_args.top_k or -1,  # top_k must > 0
+                stop_token_ids=template_obj.get_stop_token_ids(tokenizer),
+                max_tokens=generating_args.max_new_tokens,
+                skip_special_tokens=skip_special_tokens,
+                seed=seed + round_ if seed is not None else None,  # later rounds must not repeat the first candidates
+                n=n_samples,
             )
-            multi_modal_data = {"audio": zip(audio_data["audios"], audio_data["sampling_rates"])}
+        if model_args.adapter_name_or_path is not None:
+            lora_request = LoRARequest("default", 1, model_args.adapter_name_or_path[0])
         else:
-            multi_modal_data = None
+            lora_request = None
 
-        inputs.append({"prompt_token_ids": sample["input_ids"], "multi_modal_data": multi_modal_data})
-        prompts.append(tokenizer.decode(sample["input_ids"], skip_special_tokens=skip_special_tokens))
-        labels.append(
-            tokenizer.decode(
-                list(filter(lambda x: x != IGNORE_INDEX, sample["labels"])), skip_special_tokens=skip_special_tokens
+        engine_args = {
+            "model": model_args.model_name_or_path,
+            "trust_remote_code": True,
+            "dtype": model_args.infer_dtype,
+            "max_model_len": cutoff_len + max_new_tokens,
+            "tensor_parallel_size": (get_device_count() // pipeline_parallel_size) or 1,
+            "pipeline_parallel_size": pipeline_parallel_size,
+            "disable_log_stats": True,
+            "enable_lora": model_args.adapter_name_or_path is not None,
+        }
+        if template_obj.mm_plugin.__class__.__name__ != "BasePlugin":
+            engine_args["limit_mm_per_prompt"] = {"image": 4, "video": 2, "audio": 2}
+
+        if prefix_order:
+            engine_args["enable_prefix_caching"] = True
+
+        if isinstance(model_args.vllm_config, dict):
+            engine_args.update(model_args.vllm_config)
+
+    with csc.inference.PredictionWriter(save_name, len(inputs), resume=resume) as writer:
+        pending = writer.pending()
+        if len(pending) < len(inputs):
+            print(f"Resuming {save_name}: {len(inputs) - len(pending)} samples already generated.")
+
+        prompt_token_ids = [input["prompt_token_ids"] for input in inputs]
+        requests = csc.inference.plan_requests(
+            prompt_token_ids,
+            pending,
+            deduplicate=deduplicate_prompts,
+            sort=prefix_order,
+            mergeable=[input["multi_modal_data"] is None for input in inputs],
+            bucket_size=length_bucket_size,
+        )
+        if deduplicate_prompts or prefix_order:
+            print(csc.prettify(csc.inference.request_stats(prompt_token_ids, requests)))
+        if length_bucket_size:
+            print(csc.prettify({
+                "file_order_length_efficiency": csc.inference.length_efficiency(
+                    prompt_token_ids, sorted(requests, key=lambda request: request[0])
+                ),
+                "scheduled_length_efficiency": csc.inference.length_efficiency(prompt_token_ids, requests),
+            }))
+
+        if backend == "fake":
+            engine = csc.inference.FakeBackend(
+                csc.evaluation.templates[fake_template],
+                decode=tokenizer.decode,
+                encode=lambda text: tokenizer.encode(text, add_special_tokens=False),
+                seed=seed or 0,
             )
+        else:
+            engine = csc.inference.VLLMBackend(engine_args, get_sampling_params, lora_request) if requests else None
+        meter = csc.inference.generate_predictions(
+            engine,
+            inputs,
+            prompts,
+            labels,
+            requests,
+            writer,
+            n,
+            chunk_size,
+            adaptive_n=adaptive_n,
+            eval_template=csc.evaluation.templates[adaptive_template],
+            sources=sources,
+            grouped=grouped_output,
         )
 
-    sampling_params = SamplingParams(
-        repetition_penalty=generating_args.repetition_penalty or 1.0,  # repetition_penalty must > 0
-        temperature=generating_args.temperature,
-        top_p=generating_args.top_p or 1.0,  # top_p must > 0
-        top_k=generating_args.top_k or -1,  # top_k must > 0
-        stop_token_ids=template_obj.get_stop_token_ids(tokenizer),
-        max_tokens=generating_args.max_new_tokens,
-        skip_special_tokens=skip_special_tokens,
-        seed=seed,
-        n=n,
-    )
-    if model_args.adapter_name_or_path is not None:
-        lora_request = LoRARequest("default", 1, model_args.adapter_name_or_path[0])
-    else:
-        lora_request = None
-
-    engine_args = {
-        "model": model_args.model_name_or_path,
-        "trust_remote_code": True,
-        "dtype": model_args.infer_dtype,
-        "max_model_len": cutoff_len + max_new_tokens,
-        "tensor_parallel_size": (get_device_count() // pipeline_parallel_size) or 1,
-        "pipeline_parallel_size": pipeline_parallel_size,
-        "disable_log_stats": True,
-        "enable_lora": model_args.adapter_name_or_path is not None,
-    }
-    if template_obj.mm_plugin.__class__.__name__ != "BasePlugin":
-        engine_args["limit_mm_per_prompt"] = {"image": 4, "video": 2, "audio": 2}
-
-    if isinstance(model_args.vllm_config, dict):
-        engine_args.update(model_args.vllm_config)
-
-    results = LLM(**engine_args).generate(inputs, sampling_params, lora_request=lora_request)
-    preds = [[output.text for output in result.outputs] for result in results]
-    pathlib.Path(save_name).parent.mkdir(parents=True, exist_ok=True)
-    with open(save_name, "w", encoding="utf-8") as f:
-        for index, (text, pred, label) in enumerate(zip(prompts, preds, labels)):
-            for pred_i in pred:
-                f.write(json.dumps({"index": index, "prompt": text, "predict": pred_i, "label": label}, ensure_ascii=False) + "\n")
+    if meter.n_requests:
+        print(csc.prettify(meter.report()))
 
     print("*" * 70)
     print(f"{len(prompts)} generated results have been saved at {save_name}.")
@@ -4,6 +4,12 @@ import pathlib
 import csc
 
 
+def verified_sentence(item: dict) -> str:
+    """Sentence A of a verification output, from the `input` of its dataset record when inference wrote it"""
+    text = '\n' + item['input'] if item.get('input') is not None else item['prompt']
+    return text.split('\n句子A：')[1].split('\n句子B：')[0]
+
+
 def main(
         verification_outputs: str,
         verification_output_template: int,
@@ -20,22 +26,26 @@ def main(
 
     verification_output_template = csc.evaluation.templates[verification_output_template]
     csc_output_template = csc.evaluation.templates[csc_output_template]
-    verification_outputs = csc.load_file(verification_outputs)
-    csc_outputs = csc.load_file(csc_outputs)
+    verification_outputs = csc.iter_predictions(verification_outputs)
+    csc_outputs = csc.index.JSONLIndex(csc_outputs)
+    # Only keep record positions in memory, the records themselves are fetched from the index when joined.
+    # A grouped record holds all the candidates of its sentence, which are expanded when written.
     grouped_csc_outputs = {}
-    for item in csc_outputs:
-        prompt = csc_output_template.clean_prompt(item['prompt'])
+    for position, item in enumerate(csc_outputs):
+        prompt = csc_output_template.item_prompt(item)
         if prompt not in grouped_csc_outputs:
             grouped_csc_outputs[prompt] = []
-        grouped_csc_outputs[prompt].append(item)
+        grouped_csc_outputs[prompt].append(position)
     final_output = []
     for item in verification_outputs:
         verification_result = verification_output_template.clean_predict(item['predict'])
         if verification_result == 'B':
-            final_output.extend(grouped_csc_outputs[item['prompt'].split('\n句子A：')[1].split('\n句子B：')[0]])
+            final_output.extend(grouped_csc_outputs[verified_sentence(item)])
     with (report_path / 'final.jsonl').open('w', encoding='utf-8') as f:
-        for item in final_output:
-            f.write(csc.prettify(item, indent=None) + '\n')
+        for position in final_output:
+            for item in csc.expand_predictions([csc_outputs[position]]):
+                f.write(csc.prettify(item, indent=None) + '\n')
+    csc_outputs.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,52 @@
+import random
+
+import pytest
+
+import csc
+
+# Well-formed and malformed tags, newlines inside tags and stray tag characters
+PIECES = ['<csc>a</csc>', '<csc></csc>', '<csc>ab</csc>', '<csc>', '</csc>', '<csc>\n</csc>', '<csc><</csc>']
+
+
+def random_text(rng: random.Random) -> str:
+    if rng.random() < 0.1:
+        return ''
+    return ''.join(
+        rng.choice(PIECES) if rng.random() < 0.33 else rng.choice('ab\nc<>/')
+        for _ in range(rng.randint(0, 12))
+    )
+
+
+def random_batch(rng: random.Random) -> tuple[list[str], list[str]]:
+    labels = [random_text(rng) for _ in range(rng.randint(0, 40))]
+    predicts = []
+    for label in labels:
+        x = rng.random()
+        if x < 0.4:
+            predicts.append(random_text(rng))
+        else:
+            # Close to the label, missing its errors and sometimes one character longer
+            predicts.append(label.replace('<csc>a</csc>', 'a') + ('x' if x < 0.6 else ''))
+    return labels, predicts
+
+
+@pytest.mark.parametrize('template', csc.evaluation.templates)
+@pytest.mark.parametrize('seed', range(4))
+def test_eval_batch_matches_eval_one(template: type[csc.evaluation.Template], seed: int):
+    rng = random.Random(seed)
+    for _ in range(300):
+        labels, predicts = random_batch(rng)
+        batch = template.eval_batch(labels, predicts)
+        assert len(batch) == len(labels)
+        for i, (label, predict) in enumerate(zip(labels, predicts)):
+            tp, fp, fn, label_array, predict_array = template.eval_one(label, predict)
+            assert (batch.tp[i], batch.fp[i], batch.fn[i]) == (tp, fp, fn), (label, predict)
+            assert batch.label_array(i) == label_array, (label, predict)
+            assert batch.predict_array(i) == predict_array, (label, predict)
+            assert batch.label_errors[i] == sum(label_array)
+            assert batch.predict_errors[i] == sum(predict_array)
+
+
+def test_eval_batch_empty():
+    batch = csc.evaluation.Template0.eval_batch([], [])
+    assert len(batch) == 0
@@ -0,0 +1,40 @@
+import random
+
+import pytest
+
+from csc.data.utils import split_sentence_spans, split_sentences, split_sentences_regex
+
+# Terminators, closing quotes, ellipses and whitespace, which the rules of the segmenter depend on
+ALPHABET = list('。！？?”’，.…\n a字') + ['　', '\t', '\r']
+
+
+def random_texts(seed: int, n: int) -> list[str]:
+    rng = random.Random(seed)
+    return [''.join(rng.choices(ALPHABET, k=rng.randint(0, 60))) for _ in range(n)]
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_split_sentences_matches_regex(seed: int):
+    for text in random_texts(seed, 5000):
+        assert split_sentences(text) == split_sentences_regex(text), repr(text)
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_split_sentence_spans_match_regex(seed: int):
+    for text in random_texts(seed, 5000):
+        spans = split_sentence_spans(text)
+        assert [text[start:end] for start, end in spans] == split_sentences_regex(text), repr(text)
+        assert all(start <= end for start, end in spans), repr(text)
+        assert all(end <= start for (_, end), (start, _) in zip(spans, spans[1:])), repr(text)
+
+
+@pytest.mark.parametrize('text', [
+    '',
+    '你好。',
+    '他说：“走吧。”然后走了。',
+    '等等......好的。',
+    '真的吗？？是的！',
+    '结尾有空格。  \n',
+])
+def test_split_sentences_examples(text: str):
+    assert split_sentences(text) == split_sentences_regex(text)